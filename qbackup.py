@@ -1,6 +1,6 @@
 import sys
-from qbackup import cli
+from qbackup import server
 
 
 if __name__ == '__main__':
-    sys.exit(cli.main())
\ No newline at end of file
+    sys.exit(server.main())
\ No newline at end of file
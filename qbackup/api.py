@@ -3,10 +3,10 @@ Data structures for default API
 """
 
 from abc import ABC, abstractclassmethod
-from dataclasses import asdict, dataclass, field
+from dataclasses import asdict, dataclass, field, fields
 from pathlib import Path
 from types import TracebackType
-from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, Union
 from uuid import uuid4
 
 import yaml
@@ -101,6 +101,40 @@ class AbstractDataManager(ABC):
             return None
         return self._build_model(result)
 
+    def iter(self, **filters) -> Iterator[AbstractModel]:
+        """
+        Models whose fields equal `filters`, one at a time. Backends
+        filter and stream them from the storage when they can.
+        """
+        self._check_fields(filters)
+        return map(self._build_model, self._iter_data(filters))
+
+    def prefetch(
+        self,
+        related: "AbstractDataManager",
+        field: str,
+        **filters,
+    ) -> List[Tuple[AbstractModel, List[AbstractModel]]]:
+        """
+        Models whose fields equal `filters`, each with the models of
+        `related` whose `field` is its keyid, e.g. groups with their
+        qubes. Resolved in a fixed number of queries, however many
+        models are found.
+        """
+        self._check_fields(filters)
+        related._check_fields({field: None})
+
+        return [
+            (
+                self._build_model(data),
+                [related._build_model(item) for item in related_data],
+            )
+            for data, related_data in self._join_data(related, field, filters)
+        ]
+
+    def find_all(self, **filters) -> List[AbstractModel]:
+        return list(self.iter(**filters))
+
     def slow_find_all(self, **kwargs) -> Iterable[AbstractModel]:
         found_models: Iterable[AbstractModel] = []
 
@@ -127,10 +161,22 @@ class AbstractDataManager(ABC):
     def save(self) -> None:
         pass
 
+    def rollback(self) -> None:
+        """Drop the changes not saved yet"""
+        self._init()
+
     @abstractclassmethod
     def upsert(self, model: AbstractModel) -> str:
         pass
 
+    def bulk_upsert(self, models: Iterable[AbstractModel]) -> None:
+        for model in models:
+            self.upsert(model)
+
+    def clear(self) -> None:
+        for model in self.list():
+            self.delete(model.keyid())
+
     @abstractclassmethod
     def delete(self, keyid: Hashable) -> None:
         pass
@@ -143,6 +189,34 @@ class AbstractDataManager(ABC):
     def _fetch_list(self) -> Iterable[Dict]:
         pass
 
+    def _iter_data(self, filters: Dict) -> Iterable[Dict]:
+        for data in self._fetch_list():
+            if all(data.get(key) == value for key, value in filters.items()):
+                yield data
+
+    def _join_data(
+        self,
+        related: "AbstractDataManager",
+        field: str,
+        filters: Dict,
+    ) -> Iterable[Tuple[Dict, List[Dict]]]:
+        # one pass over each side, related data indexed by our keyid
+        joined = {
+            data[self._id]: (data, [])
+            for data in self._iter_data(filters)
+        }
+        for item in related._fetch_list():
+            if item[field] in joined:
+                joined[item[field]][1].append(item)
+
+        return joined.values()
+
+    def _check_fields(self, filters: Dict) -> None:
+        names = {model_field.name for model_field in fields(self._model_factory)}
+        unknown = set(filters) - names
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
     def _init(self):
         pass
 
@@ -3,29 +3,44 @@ CLI interface functions
 """
 
 import argparse
+import cProfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import heapq
+import logging
 import os
+import signal
 from pathlib import Path
-from pprint import pprint
 from re import M
 import subprocess
-from typing import Dict
-
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import (
+    compression, exchange, governor, inventory, metrics, output, planner,
+    server,
+)
 from .api import AbstractDataManager, ModelNotFound, YamlStream
 from .connectors import FileBackedConnector
 from .database import StreamDataManager
-from .models import Group, Period, Qube
+from .models import Group, Period, Qube, Run
+from .schedule import CronSchedule
 
 
 INIT_SQL = """
 CREATE TABLE groups (
     name VARCHAR NOT NULL PRIMARY KEY,
     period VARCHAR NOT NULL,
+    compression VARCHAR,
+    splittable BOOLEAN NOT NULL DEFAULT 0,
     FOREIGN KEY (period) REFERENCES periods(name)
 );
 
 CREATE TABLE periods (
-    name VARCHAR NOT NULL PRIMARY KEY
+    name VARCHAR NOT NULL PRIMARY KEY,
+    schedule VARCHAR,
+    last_run VARCHAR
 );
 
 CREATE TABLE qubes (
@@ -34,12 +49,65 @@ CREATE TABLE qubes (
     group_name VARCHAR NOT NULL,
     FOREIGN KEY (group_name) REFERENCES groups(name)
 );
+
+CREATE TABLE runs (
+    id VARCHAR NOT NULL PRIMARY KEY,
+    name VARCHAR NOT NULL,
+    started VARCHAR NOT NULL,
+    seconds REAL,
+    input_bytes INTEGER,
+    output_bytes INTEGER,
+    throttled_seconds REAL
+);
+
+CREATE INDEX groups_period ON groups (period);
+CREATE INDEX qubes_group_name ON qubes (group_name);
 """
 
+# Schema changes of databases created before `INIT_SQL` included them.
+# Append only, the position of each migration is its schema version.
+MIGRATIONS_SQL = [
+    "ALTER TABLE groups ADD COLUMN compression VARCHAR;",
+    """
+    ALTER TABLE periods ADD COLUMN schedule VARCHAR;
+    ALTER TABLE periods ADD COLUMN last_run VARCHAR;
+    """,
+    "ALTER TABLE groups ADD COLUMN splittable BOOLEAN NOT NULL DEFAULT 0;",
+    """
+    CREATE TABLE runs (
+        id VARCHAR NOT NULL PRIMARY KEY,
+        name VARCHAR NOT NULL,
+        started VARCHAR NOT NULL,
+        seconds REAL,
+        input_bytes INTEGER,
+        output_bytes INTEGER
+    );
+    """,
+    "ALTER TABLE runs ADD COLUMN throttled_seconds REAL;",
+    """
+    CREATE INDEX groups_period ON groups (period);
+    CREATE INDEX qubes_group_name ON qubes (group_name);
+    """,
+]
+
+# Models in the order they are exported and imported, so references
+# are always resolved
+MODELS = {
+    "periods": Period,
+    "groups": Group,
+    "qubes": Qube,
+    "runs": Run,
+}
+
+# Longest the daemon sleeps before looking for schedule changes
+DAEMON_RESCAN_INTERVAL = 60
+
 
 class QbackupCLIManager:
     def __init__(self, data_manager_factory) -> None:
         self.data_manager_factory = data_manager_factory
+        self.metrics = metrics.Recorder()
+        self.qube_inventory = inventory.Inventory()
 
     def initialize(self, connector, args) -> None:
         self.connector = connector
@@ -61,9 +129,17 @@ class QbackupCLIManager:
             connector,
             Qube
         )
+        self.runs: AbstractDataManager = self.data_manager_factory(
+            "runs",
+            connector,
+            Run
+        )
 
     def list_groups(self) -> None:
-        pprint(self.groups.list())
+        output.print_models(
+            self.groups.iter(**self._filters(period="period")),
+            getattr(self.args, "format", None),
+        )
 
     def add_group(self) -> None:
         group = self.groups.get(self.args.group)
@@ -77,11 +153,55 @@ class QbackupCLIManager:
                 f"Please create it first."
             )
 
-        group = Group(name=self.args.group, period=period.name)
+        group = Group(
+            name=self.args.group,
+            period=period.name,
+            compression=getattr(self.args, "compression", None),
+            splittable=bool(getattr(self.args, "splittable", False)),
+        )
+        compression.backup_args(group.compression)
 
         self.groups.upsert(group)
         self.groups.save()
 
+    def set_group(self) -> None:
+        group = self.groups.get_or_fail(self.args.group)
+
+        if self.args.compression is not None:
+            compression.backup_args(self.args.compression)
+            group.compression = self.args.compression
+
+        if self.args.splittable is not None:
+            group.splittable = self.args.splittable
+
+        self.groups.upsert(group)
+        self.groups.save()
+
+    def benchmark_group(self) -> None:
+        group = self.groups.get_or_fail(self.args.group)
+        qubes = self.qubes.find_all(group_name=group.name)
+
+        paths = self.args.sample or [
+            compression.volume_path(qube.name) for qube in qubes
+        ]
+        sample = compression.read_sample(
+            paths,
+            self.args.sample_size * 1024 * 1024,
+        )
+
+        print(f"{'FILTER':<10} {'MB/s':>10} {'RATIO':>8}")
+        for name in self.args.filters or compression.BENCHMARK_FILTERS:
+            try:
+                result = compression.benchmark(name, sample)
+            except (OSError, subprocess.CalledProcessError) as err:
+                print(f"{name:<10} failed: {err}")
+                continue
+
+            print(
+                f"{name:<10} {result.throughput / 1e6:>10.1f} "
+                f"{result.ratio:>8.3f}"
+            )
+
     def delete_qubes_from_group(self) -> None:
         group = self.groups.get_or_fail(self.args.group)
 
@@ -100,7 +220,7 @@ class QbackupCLIManager:
         self.qubes.save()
 
     def delete_group(self) -> None:
-        for qube in self.qubes.slow_find_all(
+        for qube in self.qubes.find_all(
             group_name=self.args.group
         ):
             self.qubes.delete(qube.id)
@@ -109,10 +229,14 @@ class QbackupCLIManager:
         self.groups.save()
 
     def list_qubes(self) -> None:
-        pprint(self.qubes.list())
+        output.print_models(
+            self.qubes.iter(**self._filters(group_name="group")),
+            getattr(self.args, "format", None),
+        )
 
     def associate_qubes_to_group(self) -> None:
         self.groups.get_or_fail(self.args.group)
+        self.check_qubes(self.args.qubes[0])
 
         for qube_name in self.args.qubes[0]:
             qube = self.qubes.slow_find_one(
@@ -142,17 +266,44 @@ class QbackupCLIManager:
         self.qubes.save()
 
     def list_periods(self) -> None:
-        pprint(self.periods.list())
+        output.print_models(
+            self.periods.iter(),
+            getattr(self.args, "format", None),
+        )
+
+    def _filters(self, **options: str) -> Dict[str, str]:
+        """Model field filters from the given list command options"""
+        filters = {}
+        for field, option in options.items():
+            value = getattr(self.args, option, None)
+            if value is not None:
+                filters[field] = value
+        return filters
 
     def add_periods(self) -> None:
+        schedule = getattr(self.args, "schedule", None)
+        if schedule:
+            CronSchedule(schedule)
+
         for period_name in self.args.periods[0]:
-            period = Period(period_name)
+            period = Period(period_name, schedule=schedule)
             self.periods.upsert(period)
         self.periods.save()
 
+    def set_period(self) -> None:
+        period = self.periods.get_or_fail(self.args.period)
+
+        if self.args.schedule is not None:
+            if self.args.schedule:
+                CronSchedule(self.args.schedule)
+            period.schedule = self.args.schedule or None
+
+        self.periods.upsert(period)
+        self.periods.save()
+
     def delete_periods(self) -> None:
         for period_name in self.args.periods[0]:
-            groups = self.groups.slow_find_all(
+            groups = self.groups.find_all(
                 period=period_name
             )
 
@@ -165,42 +316,444 @@ class QbackupCLIManager:
             self.periods.delete(period_name)
         self.periods.save()
 
-    def run_backup(self) -> None:
-        groups = self.groups.slow_find_all(
-            period=self.args.period
+    @property
+    def managers(self) -> Dict[str, AbstractDataManager]:
+        return {
+            "periods": self.periods,
+            "groups": self.groups,
+            "qubes": self.qubes,
+            "runs": self.runs,
+        }
+
+    def rollback(self) -> None:
+        for manager in self.managers.values():
+            manager.rollback()
+
+    def export_config(self) -> None:
+        format = self.args.format or exchange.guess_format(self.args.file)
+        records = (
+            (name, model.serialize()[1])
+            for name, manager in self.managers.items()
+            for model in manager.list()
         )
 
+        with exchange.open_file(self.args.file, "w") as fp:
+            exchange.dump(records, fp, format)
+
+    def import_config(self) -> None:
+        """
+        Import every model of a file at once. In `merge` mode models
+        are added to or update the current ones, in `replace` mode the
+        current ones are dropped first.
+        """
+        format = self.args.format or exchange.guess_format(self.args.file)
+        replace = self.args.mode == "replace"
+
+        models: Dict[str, list] = {name: [] for name in MODELS}
+        with exchange.open_file(self.args.file, "r") as fp:
+            for name, data in exchange.load(fp, format):
+                if name not in MODELS:
+                    raise ValueError(f"Unknown model: {name}")
+
+                try:
+                    models[name].append(MODELS[name](**data))
+                except TypeError as err:
+                    raise ValueError(f"Invalid {name} record: {data}") from err
+
+        self._check_values(models)
+        self._check_references(models, replace)
+
+        if not replace:
+            # qubes have random ids, keep the current ones
+            current = {
+                (qube.name, qube.group_name): qube.id
+                for qube in self.qubes.list()
+            }
+            for qube in models["qubes"]:
+                qube.id = current.setdefault(
+                    (qube.name, qube.group_name),
+                    qube.id,
+                )
+
+        # a single transaction: nothing is saved until every write is done
+        if replace:
+            for manager in reversed(self.managers.values()):
+                manager.clear()
+
+        for name, manager in self.managers.items():
+            manager.bulk_upsert(models[name])
+
+        for manager in self.managers.values():
+            manager.save()
+
+        print(", ".join(
+            f"{len(models[name])} {name}" for name in MODELS
+        ) + " imported")
+
+    @staticmethod
+    def _check_values(models: Dict[str, list]) -> None:
+        """Validate imported models as `add` and `set` commands do"""
+        for period in models["periods"]:
+            if period.schedule:
+                try:
+                    CronSchedule(period.schedule)
+                except ValueError as err:
+                    raise ValueError(f"{err} (period {period.name})") from err
+
+        for group in models["groups"]:
+            try:
+                compression.backup_args(group.compression)
+            except ValueError as err:
+                raise ValueError(f"{err} (group {group.name})") from err
+
+    def _check_references(
+        self,
+        models: Dict[str, list],
+        replace: bool,
+    ) -> None:
+        periods = {period.name for period in models["periods"]}
+        groups = {group.name for group in models["groups"]}
+        if not replace:
+            periods.update(period.name for period in self.periods.list())
+            groups.update(group.name for group in self.groups.list())
+
+        for group in models["groups"]:
+            if group.period not in periods:
+                raise ModelNotFound(
+                    f"Period not found: {group.period} (group {group.name})"
+                )
+
+        for qube in models["qubes"]:
+            if qube.group_name not in groups:
+                raise ModelNotFound(
+                    f"Group not found: {qube.group_name} (qube {qube.name})"
+                )
+
+    def check_qubes(self, names: Iterable[str]) -> Dict[str, int]:
+        """
+        Check all `names` are qubes of the system, from a single inventory
+        lookup. Returns the qube sizes, empty when qubes cannot be listed.
+        """
+        try:
+            self.qube_inventory.validate(names)
+            return self.qube_inventory.sizes()
+        except (OSError, subprocess.CalledProcessError) as err:
+            print(f"[-] cannot list qubes, names not checked: {err}",
+                  file=sys.stderr)
+            return {}
+
+    def qube_sizes(self) -> Dict[str, int]:
+        """Sizes of the qubes of the system, empty when they cannot be listed"""
+        try:
+            return self.qube_inventory.sizes()
+        except (OSError, subprocess.CalledProcessError) as err:
+            print(f"[-] cannot list qubes, sizes unknown: {err}",
+                  file=sys.stderr)
+            return {}
+
+    def run_backup(self, period: str = None) -> None:
+        period = period or self.args.period
+        groups, members = self.period_groups(period)
+
         if not groups:
             raise ModelNotFound(
-                f"No groups found for period: {self.args.period}"
+                f"No groups found for period: {period}"
             )
 
-        subprocess.run([
-            "notify-send",
-            "-u",
-            "critical",
-            "Automated Backup",
-            f"Starting backup: {self.args.period}"
-        ], env={"DISPLAY": ":0"})
+        if getattr(self.args, "plan", False):
+            self.plan_backup(groups, members)
+            return
 
+        try:
+            with self.metrics.span("run", period=period):
+                # a missing qube fails the run before any data moves,
+                # not when qvm-backup reaches its group
+                with self.metrics.span("inventory"):
+                    sizes = self.check_qubes(
+                        qube for qubes in members.values() for qube in qubes
+                    )
+
+                subprocess.run([
+                    "notify-send",
+                    "-u",
+                    "critical",
+                    "Automated Backup",
+                    f"Starting backup: {period}"
+                ], env={**os.environ, "DISPLAY": ":0"})
+
+                jobs = getattr(self.args, "jobs", None)
+                if jobs:
+                    self.run_backup_jobs(period, groups, members, jobs)
+                    return
+
+                for group in groups:
+                    self.run_backup_for_group(
+                        group,
+                        members[group.name],
+                        sizes,
+                    )
+        finally:
+            self.export_metrics(period)
+
+    def export_metrics(self, period: str) -> None:
+        """
+        Write the spans of the run to `--metrics-dir`, as a textfile for
+        node_exporter and a JSON trace, and start recording anew.
+        """
+        directory = getattr(self.args, "metrics_dir", None)
+        if directory:
+            directory = Path(directory).expanduser()
+            self.metrics.export(
+                directory / f"qbackup-{period}.prom",
+                directory / f"qbackup-{period}.trace.json",
+                run=period,
+            )
+        self.metrics = metrics.Recorder()
+
+    def period_groups(
+        self,
+        period: str,
+    ) -> Tuple[List[Group], Dict[str, List[str]]]:
+        """
+        Groups of `period`, and the qube names of each group, from a
+        single datastore query
+        """
+        groups = []
+        members = {}
+
+        for group, qubes in self.groups.prefetch(
+            self.qubes,
+            "group_name",
+            period=period,
+        ):
+            groups.append(group)
+            members[group.name] = [qube.name for qube in qubes]
+
+        return groups, members
+
+    def plan_backup(
+        self,
+        groups: List[Group],
+        members: Dict[str, List[str]],
+    ) -> None:
+        """
+        Print the size and duration estimates of a backup, resolving
+        everything in a fixed number of lookups.
+        """
+        if not any(members.values()):
+            print(f"[-] no qubes to back up in period: {groups[0].period}",
+                  file=sys.stderr)
+            return
+
+        sizes = self.qube_sizes()
+
+        history: Dict[str, List[Run]] = {}
+        for run in self.runs.list():
+            history.setdefault(run.name, []).append(run)
+        all_runs = [run for runs in history.values() for run in runs]
+
+        print(
+            f"{'GROUP':<20} {'QUBES':>5} {'INPUT':>10} "
+            f"{'OUTPUT':>10} {'DURATION':>10}"
+        )
+
+        estimates = {}
         for group in groups:
-            self.run_backup_for_group(group)
+            qubes = members[group.name]
+            estimate = planner.estimate(
+                sum(sizes.get(qube, 0) for qube in qubes),
+                history.get(group.name) or all_runs,
+                group.compression,
+            )
+            estimates[group.name] = estimate
+
+            missing = [qube for qube in qubes if qube not in sizes]
+            print(
+                f"{group.name:<20} {len(qubes):>5} "
+                f"{format_size(estimate.input_bytes):>10} "
+                f"{format_size(estimate.output_bytes):>10} "
+                f"{format_duration(estimate.seconds):>10}"
+                + (f"  unknown qubes: {', '.join(missing)}" if missing else "")
+            )
+
+        total_seconds = sum(estimate.seconds for estimate in estimates.values())
 
-    def run_backup_for_group(self, group: Group) -> None:
-        qubes = self.qubes.slow_find_all(
-            group_name=group.name
+        jobs = getattr(self.args, "jobs", None)
+        if jobs:
+            units = planner.plan_units(
+                members,
+                sizes,
+                {group.name for group in groups if group.splittable},
+            )
+            plan = planner.pack(units, jobs)
+            total_input = sum(e.input_bytes for e in estimates.values())
+            rate = total_input / max(total_seconds, 1e-6)
+            total_seconds = max(job.size for job in plan) / max(rate, 1e-6)
+
+        print(
+            f"{'TOTAL':<20} "
+            f"{sum(len(qubes) for qubes in members.values()):>5} "
+            f"{format_size(sum(e.input_bytes for e in estimates.values())):>10} "
+            f"{format_size(sum(e.output_bytes for e in estimates.values())):>10} "
+            f"{format_duration(total_seconds):>10}"
+        )
+
+    def run_backup_jobs(
+        self,
+        period: str,
+        groups: List[Group],
+        members: Dict[str, List[str]],
+        jobs: int,
+    ) -> None:
+        """
+        Pack the period qubes into `jobs` jobs of balanced size and run
+        them concurrently. Jobs take the settings of their main group.
+        """
+        units = planner.plan_units(
+            members,
+            self.qube_sizes(),
+            {group.name for group in groups if group.splittable},
         )
+        plan = planner.pack(units, jobs)
+        if not plan:
+            print(f"[-] no qubes to back up in period: {period}",
+                  file=sys.stderr)
+            return
+
+        compressions = {group.name: group.compression for group in groups}
+
+        # concurrent jobs do not all start reading disks at once
+        stagger = getattr(self.args, "stagger", None) or 0
+
+        with ThreadPoolExecutor(len(plan)) as executor:
+            futures = []
+            for index, job in enumerate(plan):
+                if index:
+                    time.sleep(stagger)
+                futures.append(executor.submit(
+                    self.backup_qubes,
+                    f"{period}-job{index}",
+                    job.qubes,
+                    compressions[job.main_group],
+                    job.size,
+                ))
+
+            # the datastore connection belongs to this thread. Runs are
+            # recorded by group, as estimates learn from group history
+            for job, future in zip(plan, futures):
+                self.runs.bulk_upsert(planner.group_runs(future.result(), job))
+        self.runs.save()
+
+    def schedule_periods(self, now: datetime) -> List[Tuple[datetime, str]]:
+        """
+        Priority queue with the next run of every scheduled period.
+        A period which missed runs since its last one, e.g. because
+        dom0 was off, is due right away, but only once.
+        """
+        queue = []
+
+        for period in self.periods.list():
+            if not period.schedule:
+                continue
+
+            last_run = now
+            if period.last_run is not None:
+                last_run = datetime.fromisoformat(period.last_run)
+
+            try:
+                next_run = CronSchedule(period.schedule).next_after(last_run)
+            except ValueError as err:
+                print(f"[-] period not scheduled: {period.name}: {err}")
+                continue
+            heapq.heappush(queue, (next_run, period.name))
+
+        return queue
+
+    def run_daemon(self) -> None:
+        while True:
+            # see the changes other qbackup calls saved meanwhile
+            self.rollback()
+            now = datetime.now()
+            queue = self.schedule_periods(now)
+
+            due = []
+            while queue and queue[0][0] <= now:
+                due.append(heapq.heappop(queue)[1])
+
+            if not due:
+                delay = DAEMON_RESCAN_INTERVAL
+                if queue:
+                    delay = (queue[0][0] - now).total_seconds()
+                time.sleep(min(delay, DAEMON_RESCAN_INTERVAL))
+                continue
+
+            for period_name in due:
+                self.run_scheduled_period(period_name)
+
+    def run_scheduled_period(self, period_name: str) -> None:
+        period = self.periods.get_or_fail(period_name)
+
+        # record the run before it starts, so a failing period is
+        # retried on its next schedule rather than right away
+        period.last_run = datetime.now().isoformat(timespec="seconds")
+        self.periods.upsert(period)
+        self.periods.save()
 
-        subprocess.run([
-            "notify-send",
-            "Automated Backup",
-            f"Starting backup for group: {group.name}"
-        ], env={"DISPLAY": ":0"})
+        print(f"[+] running scheduled period: {period_name}")
+        # whatever goes wrong, later periods must still run
+        try:
+            self.run_backup(period_name)
+        except Exception as err:
+            print(
+                f"[-] scheduled period failed: {period_name}: "
+                f"{type(err).__name__}: {err}"
+            )
 
-        now = datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
+    def run_backup_for_group(
+        self,
+        group: Group,
+        qubes: List[str],
+        sizes: Dict[str, int] = None,
+    ) -> None:
+        with self.metrics.span("group", group=group.name) as span:
+            subprocess.run([
+                "notify-send",
+                "Automated Backup",
+                f"Starting backup for group: {group.name}"
+            ], env={**os.environ, "DISPLAY": ":0"})
+
+            input_bytes = None
+            if sizes:
+                input_bytes = sum(sizes.get(qube, 0) for qube in qubes)
+            span.bytes = input_bytes
+
+            run = self.backup_qubes(
+                group.name,
+                qubes,
+                group.compression,
+                input_bytes,
+            )
+            self.runs.upsert(run)
+            self.runs.save()
+
+    def backup_qubes(
+        self,
+        name: str,
+        qubes: List[str],
+        compression_filter: str = None,
+        input_bytes: int = None,
+    ) -> Run:
+        """
+        Back `qubes` up as `name`. Returns the run record, to be saved
+        by the caller, as jobs run this from other threads.
+        """
+        started = datetime.now()
+        now = started.strftime("%Y-%m-%dT%H-%M-%S")
+        path = f"{name}-{now}.backup"
         remote_command = " ; ".join([
             ". ~/.bash_profile",
-            f"ssh $SSH_CONN {group.name}-{now}.backup",
+            # fans out to every server of SSH_CONN
+            f"qbackup-carrier --disk - -- {path}",
         ])
 
         dest_vm = "home-backups"
@@ -208,7 +761,7 @@ class QbackupCLIManager:
         args = [
             "qvm-backup",
             "--yes",
-            "--compress",
+            *compression.backup_args(compression_filter),
             "--exclude",
             "dom0",
             "--dest-vm",
@@ -216,11 +769,148 @@ class QbackupCLIManager:
             f"sh -c '{remote_command}'",
         ]
 
-        for qube in qubes:
-            args.append(qube.name)
+        args.extend(qubes)
 
         password = b"abc"
-        subprocess.run(args, input=password + b"\n")
+        with self.metrics.span("qvm-backup", backup=name) as span:
+            span.bytes = input_bytes
+            throttled = self.resource_governor().run(
+                args,
+                input=password + b"\n",
+            )
+
+        seconds = (datetime.now() - started).total_seconds()
+
+        return Run(
+            name=name,
+            started=started.isoformat(timespec="seconds"),
+            seconds=seconds,
+            input_bytes=input_bytes,
+            output_bytes=self.stored_size(dest_vm, path),
+            throttled_seconds=throttled,
+        )
+
+    def stored_size(self, dest_vm: str, path: str) -> Optional[int]:
+        """
+        Size of a backup as the servers store it, i.e. compressed, asked
+        through `dest_vm`. None when no server tells it.
+        """
+        try:
+            result = subprocess.run(
+                [
+                    "qvm-run",
+                    "--pass-io",
+                    dest_vm,
+                    f". ~/.bash_profile ; qbackup-carrier --stat -- {path}",
+                ],
+                stdout=subprocess.PIPE,
+                check=True,
+                text=True,
+            )
+            return int(result.stdout)
+        except (OSError, subprocess.CalledProcessError, ValueError) as err:
+            print(f"[-] stored size of {path} unknown: {err}",
+                  file=sys.stderr)
+            return None
+
+    def resource_governor(self) -> governor.Governor:
+        """Priority and throttling of backups, from `run` or `daemon`"""
+        return governor.Governor(
+            governor.Priority(
+                nice=getattr(self.args, "nice", None),
+                ionice=getattr(self.args, "ionice", None),
+                cpu_weight=getattr(self.args, "cpu_weight", None),
+                io_weight=getattr(self.args, "io_weight", None),
+            ),
+            max_load=getattr(self.args, "max_load", None),
+            idle_seconds=getattr(self.args, "idle_seconds", None),
+            duty=getattr(self.args, "throttle_duty", governor.DEFAULT_DUTY),
+        )
+
+
+def ionice_class(value: str) -> str:
+    try:
+        governor.ionice_args(value)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(str(err))
+    return value
+
+
+def add_jobs_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Pack the period qubes by size into this many concurrent "
+             "backups. Groups are kept whole unless splittable",
+    )
+    parser.add_argument(
+        "--stagger",
+        type=float,
+        default=30,
+        help="Seconds between the starts of concurrent jobs. Default is 30",
+    )
+
+
+def add_governor_arguments(parser: argparse.ArgumentParser) -> None:
+    """Options of `governor.Governor`, shared by `run` and `daemon`"""
+    parser.add_argument(
+        "--nice",
+        type=int,
+        default=10,
+        help="Niceness of the qvm-backup client. Default is 10",
+    )
+    parser.add_argument(
+        "--ionice",
+        type=ionice_class,
+        default="best-effort:7",
+        help="IO scheduling CLASS[:LEVEL], CLASS being realtime, "
+             "best-effort or idle. Default is best-effort:7",
+    )
+    parser.add_argument(
+        "--cpu-weight",
+        type=int,
+        help="cgroup CPU weight, 1 to 10000 where 100 is the default, "
+             "set through systemd-run",
+    )
+    parser.add_argument(
+        "--io-weight",
+        type=int,
+        help="cgroup IO weight, 1 to 10000 where 100 is the default, "
+             "set through systemd-run",
+    )
+    parser.add_argument(
+        "--max-load",
+        type=float,
+        help="Throttle backups while the load average per CPU, theirs "
+             "included, is above this",
+    )
+    parser.add_argument(
+        "--idle-seconds",
+        type=float,
+        help="Throttle backups while the desktop had input in the last "
+             "seconds, as told by xprintidle",
+    )
+    parser.add_argument(
+        "--throttle-duty",
+        type=float,
+        default=governor.DEFAULT_DUTY,
+        help="Fraction of the time a throttled backup keeps running. "
+             f"Default is {governor.DEFAULT_DUTY}",
+    )
+
+
+def format_size(size: int) -> str:
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024:
+            return f"{size:.0f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TiB"
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}"
 
 
 class CommandLineInterface:
@@ -228,23 +918,39 @@ class CommandLineInterface:
         self.local_path: Path = None
         self.database: Path = None
         self.bootstrap_sql: str = None
+        self.backend: str = None
         self.cli_manager: QbackupCLIManager = None
+        self.parser: argparse.ArgumentParser = None
 
     def run(self, cli_args: Dict[str, str] = None) -> None:
-        connector_factory, data_manager_factory = self.deduce_database()
+        # the data manager depends on the chosen backend, so it is only
+        # known once arguments are parsed
+        self.cli_manager = QbackupCLIManager(None)
 
-        self.cli_manager = QbackupCLIManager(data_manager_factory)
-
-        parser = self.get_parser()
+        parser = self.parser = self.get_parser()
         args = parser.parse_args(cli_args)
 
         if not hasattr(args, "function"):
             parser.error("Missing command")
 
+        logging.basicConfig(
+            level=logging.DEBUG if args.verbose else logging.WARNING,
+            format="[+] %(message)s",
+        )
+
+        self.backend = args.backend
+        connector_factory, data_manager_factory = self.deduce_database(
+            args.backend
+        )
+        self.cli_manager.data_manager_factory = data_manager_factory
+
         self.local_path = Path(args.config).expanduser()
         os.makedirs(self.local_path, exist_ok=True)
 
         self.database = self.local_path / "db"
+        self.cli_manager.qube_inventory = inventory.Inventory(
+            self.local_path / inventory.CACHE_NAME
+        )
 
         self.bootstrap_sql = None
         if not self.database.exists():
@@ -252,26 +958,93 @@ class CommandLineInterface:
 
         with connector_factory(self.database) as connector:
             self.cli_manager.initialize(connector, args)
-            args.function()
-
-    def deduce_database(self):
+            if not args.profile:
+                args.function()
+                return
+
+            profile = cProfile.Profile()
+            try:
+                profile.runcall(args.function)
+            finally:
+                profile.dump_stats(args.profile)
+
+    def serve(self) -> None:
+        """
+        Keep the datastore open and run the commands of `qbackup`
+        clients, see `server.serve`.
+        """
+        # stopping the server, e.g. by systemd, must remove the socket
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+        server.serve(self.local_path / server.SOCKET_NAME, self.execute)
+
+    def execute(self, argv: List[str]) -> Optional[int]:
+        """
+        Run a command line with the open datastore. Returns the exit
+        status, or None when it must run in its own process: long running
+        commands, and commands for another configuration.
+        """
         try:
-            import sqlite3
-            from .database import SqliteDataManager
-            from .connectors import SqliteConnector
+            args = self.parser.parse_args(argv)
+        except SystemExit as exit:
+            return exit.code
 
-            def connector_factory(path):
-                return SqliteConnector(path, self.bootstrap_sql)
-
-            return (
-                connector_factory,
-                SqliteDataManager
+        if not hasattr(args, "function"):
+            print("Missing command", file=sys.stderr)
+            return 2
+
+        if (
+            not getattr(args, "resident", True)
+            or Path(args.config).expanduser() != self.local_path
+            or args.backend != self.backend
+            or args.profile
+            or (
+                # standard input is not forwarded
+                args.function == self.cli_manager.import_config
+                and args.file == "-"
             )
-        except ImportError:
-            pass
+        ):
+            return None
+
+        self.cli_manager.args = args
+        try:
+            # see the changes of qbackup calls not made through us
+            self.cli_manager.rollback()
+            args.function()
+        except Exception as err:
+            self.cli_manager.rollback()
+            print(f"{type(err).__name__}: {err}", file=sys.stderr)
+            return 1
+
+        return 0
+
+    def deduce_database(self, backend: str = None):
+        if backend != "yaml":
+            try:
+                import sqlite3
+                from .database import SqliteDataManager
+                from .connectors import SqliteConnector
+
+                def connector_factory(path):
+                    return SqliteConnector(
+                        path,
+                        self.bootstrap_sql,
+                        MIGRATIONS_SQL,
+                    )
+
+                return (
+                    connector_factory,
+                    SqliteDataManager
+                )
+            except ImportError:
+                if backend == "sqlite":
+                    raise
+
+        def connector_factory(path):
+            return FileBackedConnector(self.local_path)
 
         def data_manager_factory(*args, **kwargs):
-            stream = YamlStream(self.local_path)
+            stream = YamlStream(self.local_path / "db.yaml")
             return StreamDataManager(
                 stream,
                 *args,
@@ -279,7 +1052,7 @@ class CommandLineInterface:
             )
 
         return (
-            FileBackedConnector,
+            connector_factory,
             data_manager_factory
         )
 
@@ -293,6 +1066,23 @@ class CommandLineInterface:
             help="Path to configuration directory. Default is ~/.config/qbackup",
             default="~/.config/qbackup"
         )
+        parser.add_argument(
+            "-v",
+            "--verbose",
+            action="store_true",
+            help="Log every datastore query",
+        )
+        parser.add_argument(
+            "--backend",
+            choices=["sqlite", "yaml"],
+            help="Configuration storage. Default is sqlite when available",
+        )
+        parser.add_argument(
+            "--profile",
+            metavar="FILE",
+            help="Profile the command, writing cProfile stats to FILE, "
+                 "e.g. for `python -m pstats FILE`",
+        )
 
         subparsers = parser.add_subparsers()
 
@@ -301,10 +1091,80 @@ class CommandLineInterface:
 
         run_parser = subparsers.add_parser("run")
         run_parser.add_argument("period", type=str)
+        add_jobs_arguments(run_parser)
+        run_parser.add_argument(
+            "--plan",
+            action="store_true",
+            help="Only print size and duration estimates of the backup",
+        )
+        run_parser.add_argument(
+            "--metrics-dir",
+            help="Write stage metrics of the run to this directory, "
+                 "e.g. the node_exporter textfile collector one",
+        )
+        add_governor_arguments(run_parser)
         run_parser.set_defaults(
-            function=self.cli_manager.run_backup
+            function=self.cli_manager.run_backup,
+            resident=False,
+        )
+
+        export_parser = subparsers.add_parser("export")
+        export_parser.add_argument(
+            "file",
+            nargs="?",
+            default="-",
+            help="Output file, or `-` for standard output (the default)",
+        )
+        export_parser.add_argument(
+            "--format",
+            choices=exchange.FORMATS,
+            help="Default is guessed from the file extension, or jsonl",
+        )
+        export_parser.set_defaults(
+            function=self.cli_manager.export_config
         )
 
+        import_parser = subparsers.add_parser("import")
+        import_parser.add_argument(
+            "file",
+            help="Input file, or `-` for standard input",
+        )
+        import_parser.add_argument(
+            "--format",
+            choices=exchange.FORMATS,
+            help="Default is guessed from the file extension, or jsonl",
+        )
+        import_parser.add_argument(
+            "--mode",
+            choices=["merge", "replace"],
+            default="merge",
+            help="Add to the current configuration, or replace it. "
+                 "Default is merge",
+        )
+        import_parser.set_defaults(
+            function=self.cli_manager.import_config
+        )
+
+        daemon_parser = subparsers.add_parser("daemon")
+        add_jobs_arguments(daemon_parser)
+        daemon_parser.add_argument(
+            "--metrics-dir",
+            help="Write stage metrics of each run to this directory",
+        )
+        add_governor_arguments(daemon_parser)
+        daemon_parser.set_defaults(
+            function=self.cli_manager.run_daemon,
+            resident=False,
+        )
+
+        serve_parser = subparsers.add_parser(
+            "serve",
+            help="Keep the configuration open and run the commands of "
+                 "other qbackup calls, which fall back to running on "
+                 "their own when no server is listening",
+        )
+        serve_parser.set_defaults(function=self.serve, resident=False)
+
         qube_parser = subparsers.add_parser("qube")
         qube_subparsers = qube_parser.add_subparsers()
 
@@ -323,6 +1183,8 @@ class CommandLineInterface:
         )
 
         ls_qube_parser = qube_subparsers.add_parser("list")
+        ls_qube_parser.add_argument("--group", help="Only qubes of this group")
+        ls_qube_parser.add_argument("--format", choices=output.FORMATS)
         ls_qube_parser.set_defaults(
             function=self.cli_manager.list_qubes
         )
@@ -333,10 +1195,58 @@ class CommandLineInterface:
         add_group_parser = group_subparsers.add_parser("add")
         add_group_parser.add_argument("group", type=str, help="Group name")
         add_group_parser.add_argument("period", type=str, help="Period")
+        add_group_parser.add_argument(
+            "--compression",
+            type=str,
+            help="Compression filter program, or `none`. Default is gzip",
+        )
+        add_group_parser.add_argument(
+            "--splittable",
+            action="store_true",
+            help="Allow `run --jobs` to spread the group qubes across jobs",
+        )
         add_group_parser.set_defaults(
             function=self.cli_manager.add_group
         )
 
+        set_group_parser = group_subparsers.add_parser("set")
+        set_group_parser.add_argument("group", type=str, help="Group name")
+        set_group_parser.add_argument(
+            "--compression",
+            type=str,
+            help="Compression filter program, or `none`",
+        )
+        set_group_parser.add_argument(
+            "--splittable",
+            action=argparse.BooleanOptionalAction,
+            help="Allow `run --jobs` to spread the group qubes across jobs",
+        )
+        set_group_parser.set_defaults(
+            function=self.cli_manager.set_group
+        )
+
+        bench_group_parser = group_subparsers.add_parser("benchmark")
+        bench_group_parser.add_argument("group", type=str, help="Group name")
+        bench_group_parser.add_argument(
+            "--filters",
+            nargs="+",
+            help="Compression filters to try",
+        )
+        bench_group_parser.add_argument(
+            "--sample",
+            nargs="+",
+            help="Files sampled instead of the group qubes private volumes",
+        )
+        bench_group_parser.add_argument(
+            "--sample-size",
+            type=int,
+            default=256,
+            help="Sample size in MiB. Default is 256",
+        )
+        bench_group_parser.set_defaults(
+            function=self.cli_manager.benchmark_group
+        )
+
         del_group_parser = group_subparsers.add_parser("del")
         del_group_parser.add_argument("group", help="Group name")
         del_group_parser.set_defaults(
@@ -344,6 +1254,11 @@ class CommandLineInterface:
         )
 
         ls_group_parser = group_subparsers.add_parser("list")
+        ls_group_parser.add_argument(
+            "--period",
+            help="Only groups of this period",
+        )
+        ls_group_parser.add_argument("--format", choices=output.FORMATS)
         ls_group_parser.set_defaults(
             function=self.cli_manager.list_groups
         )
@@ -368,11 +1283,28 @@ class CommandLineInterface:
             nargs="+",
             help="Period name"
         )
+        add_period_parser.add_argument(
+            "--schedule",
+            type=str,
+            help="Cron expression, e.g. '0 2 * * *', run by `qbackup daemon`",
+        )
         add_period_parser.set_defaults(
             function=self.cli_manager.add_periods
         )
 
+        set_period_parser = period_subparsers.add_parser("set")
+        set_period_parser.add_argument("period", type=str, help="Period name")
+        set_period_parser.add_argument(
+            "--schedule",
+            type=str,
+            help="Cron expression, or an empty string to unschedule",
+        )
+        set_period_parser.set_defaults(
+            function=self.cli_manager.set_period
+        )
+
         ls_period_parser = period_subparsers.add_parser("list")
+        ls_period_parser.add_argument("--format", choices=output.FORMATS)
         ls_period_parser.set_defaults(
             function=self.cli_manager.list_periods
         )
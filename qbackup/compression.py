@@ -0,0 +1,106 @@
+"""
+Compression filters for qvm-backup
+"""
+
+import subprocess
+import time
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+
+# compression filter used when a group does not choose one
+DEFAULT_FILTER = "gzip"
+
+# filter which disables compression altogether
+NO_FILTER = "none"
+
+# filters tried by the benchmark when none is given
+BENCHMARK_FILTERS = ["gzip", "pigz", "zstd", "zstdmt", "xz"]
+
+
+@dataclass
+class BenchmarkResult:
+    compression: str
+    input_bytes: int
+    output_bytes: int
+    seconds: float
+
+    @property
+    def throughput(self) -> float:
+        """Input bytes compressed per second"""
+        return self.input_bytes / max(self.seconds, 1e-6)
+
+    @property
+    def ratio(self) -> float:
+        """Output size relative to input size"""
+        return self.output_bytes / max(self.input_bytes, 1)
+
+
+def backup_args(compression: Optional[str]) -> List[str]:
+    """
+    `qvm-backup` arguments selecting a compression filter.
+
+    The filter is run by qubesd as a bare program name, both to compress
+    and, with `-d`, to restore. So multi-threaded variants are chosen by
+    program name, e.g. `pigz` or `zstdmt`, rather than by options.
+    """
+    if compression is None or compression == DEFAULT_FILTER:
+        return ["--compress"]
+
+    if compression == NO_FILTER:
+        return ["--no-compress"]
+
+    if not compression.replace("-", "").replace("_", "").isalnum():
+        raise ValueError(f"Invalid compression filter: {compression}")
+
+    return ["--compress-filter", compression]
+
+
+def volume_path(qube: str) -> str:
+    """Private volume of a qube in the default dom0 LVM thin pool"""
+    return f"/dev/qubes_dom0/vm-{qube}-private"
+
+
+def read_sample(paths: Iterable[str], size: int) -> bytes:
+    """
+    Read a sample of `size` bytes, spread evenly across `paths`.
+    """
+    paths = list(paths)
+    if not paths:
+        return b""
+
+    chunk_size = size // len(paths)
+    chunks = []
+
+    for path in paths:
+        result = subprocess.run(
+            ["sudo", "head", "-c", str(chunk_size), path],
+            stdout=subprocess.PIPE,
+            check=True,
+        )
+        chunks.append(result.stdout)
+
+    return b"".join(chunks)
+
+
+def benchmark(compression: str, sample: bytes) -> BenchmarkResult:
+    """
+    Compress `sample` the way qubesd would and measure it.
+    """
+    if compression == NO_FILTER:
+        return BenchmarkResult(compression, len(sample), len(sample), 0)
+
+    started = time.monotonic()
+    result = subprocess.run(
+        [compression],
+        input=sample,
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    seconds = time.monotonic() - started
+
+    return BenchmarkResult(
+        compression,
+        len(sample),
+        len(result.stdout),
+        seconds,
+    )
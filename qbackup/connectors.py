@@ -6,7 +6,7 @@ import os
 import fcntl
 import sqlite3
 from pathlib import Path
-from typing import Optional, cast
+from typing import Optional, Sequence, cast
 from .api import AbstractDataConnector
 
 
@@ -41,10 +41,16 @@ class FileBackedConnector(AbstractDataConnector):
 
 
 class SqliteConnector(AbstractDataConnector):
-    def __init__(self, database: str, bootstrap_sql: str = None) -> None:
+    def __init__(
+        self,
+        database: str,
+        bootstrap_sql: str = None,
+        migrations: Sequence[str] = (),
+    ) -> None:
         super().__init__()
         self._database = database
         self._bootstrap_sql = bootstrap_sql
+        self._migrations = migrations
         self._conn: Optional[sqlite3.Connection] = None
 
     def connect(self) -> None:
@@ -53,5 +59,20 @@ class SqliteConnector(AbstractDataConnector):
             self._conn.executescript(self._bootstrap_sql)
             self._conn.commit()
 
+        if self._migrations:
+            self._migrate()
+
+    def _migrate(self) -> None:
+        # The bootstrap sql always creates the latest schema, so only
+        # databases created before it need to be migrated
+        version = len(self._migrations)
+        if self._bootstrap_sql is None:
+            version, = self._conn.execute("PRAGMA user_version").fetchone()
+            for migration in self._migrations[version:]:
+                self._conn.executescript(migration)
+
+        self._conn.execute(f"PRAGMA user_version = {len(self._migrations)}")
+        self._conn.commit()
+
     def close(self) -> None:
         self._conn.close()
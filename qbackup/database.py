@@ -1,5 +1,7 @@
+import logging
 import sqlite3
-from typing import Any, Dict, Hashable, Iterable, Optional
+from dataclasses import fields
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
 
 from qbackup.connectors import SqliteConnector
 from .api import (
@@ -10,6 +12,8 @@ from .api import (
 
 __all__ = ["SqliteDataManager", "StreamDataManager"]
 
+logger = logging.getLogger(__name__)
+
 
 class SqliteDataManager(AbstractDataManager):
     def __init__(
@@ -30,6 +34,9 @@ class SqliteDataManager(AbstractDataManager):
     def save(self) -> None:
         self._connector._conn.commit()
 
+    def rollback(self) -> None:
+        self._connector._conn.rollback()
+
     def upsert(self, model: AbstractModel) -> str:
         model_id, model_data = model.serialize()
 
@@ -75,6 +82,29 @@ class SqliteDataManager(AbstractDataManager):
                     {self._id} = ?
             """, [*model_data.values(), model_id])
 
+    def bulk_upsert(self, models: Iterable[AbstractModel]) -> None:
+        rows = [model.serialize()[1] for model in models]
+        if not rows:
+            return
+
+        fields = list(rows[0].keys())
+        fields_str = ",".join(fields)
+        placeholders_str = ",".join("?" for _ in fields)
+
+        self._executemany_sql(f"""
+            INSERT OR REPLACE INTO
+                {self._prefix}
+            ({fields_str})
+            VALUES
+                ({placeholders_str})
+        """, [[row[field] for field in fields] for row in rows])
+
+    def clear(self) -> None:
+        self._execute_sql(f"""
+            DELETE FROM
+                {self._prefix}
+        """)
+
     def delete(self, keyid: Hashable) -> None:
         self.get_or_fail(keyid)
 
@@ -107,6 +137,67 @@ class SqliteDataManager(AbstractDataManager):
 
         return cursor.fetchall()
 
+    def _iter_data(self, filters: Dict) -> Iterable[sqlite3.Row]:
+        # field names are checked against the model by `iter`
+        where_str = " AND ".join(f"{field} = ?" for field in filters)
+
+        return self._execute_sql(f"""
+            SELECT
+                *
+            FROM
+                {self._prefix}
+            {"WHERE " + where_str if filters else ""}
+        """, list(filters.values()))
+
+    def _join_data(
+        self,
+        related: AbstractDataManager,
+        field: str,
+        filters: Dict,
+    ) -> Iterable[Tuple[Dict, List[Dict]]]:
+        if (
+            not isinstance(related, SqliteDataManager)
+            or related._connector is not self._connector
+        ):
+            return super()._join_data(related, field, filters)
+
+        # both tables may share column names, so columns are prefixed
+        # with the side they come from
+        names = [f.name for f in fields(self._model_factory)]
+        related_names = [f.name for f in fields(related._model_factory)]
+        columns_str = ",".join(
+            [f"model.{name} AS model_{name}" for name in names]
+            + [f"related.{name} AS related_{name}" for name in related_names]
+        )
+        where_str = " AND ".join(f"model.{key} = ?" for key in filters)
+
+        cursor = self._execute_sql(f"""
+            SELECT
+                {columns_str}
+            FROM
+                {self._prefix} AS model
+            LEFT JOIN
+                {related._prefix} AS related
+            ON
+                related.{field} = model.{self._id}
+            {"WHERE " + where_str if filters else ""}
+            ORDER BY
+                model.rowid, related.rowid
+        """, list(filters.values()))
+
+        joined = {}
+        for row in cursor:
+            data = {name: row[f"model_{name}"] for name in names}
+            _, related_data = joined.setdefault(data[self._id], (data, []))
+
+            # no related models leaves the related columns null
+            if row[f"related_{related._id}"] is not None:
+                related_data.append(
+                    {name: row[f"related_{name}"] for name in related_names}
+                )
+
+        return joined.values()
+
     def _build_model(self, kwargs: Dict) -> AbstractModel:
         if isinstance(kwargs, sqlite3.Row):
             kwargs = dict(kwargs)
@@ -114,9 +205,13 @@ class SqliteDataManager(AbstractDataManager):
         return super()._build_model(kwargs)
 
     def _execute_sql(self, sql_str: str, *args, **kwargs) -> sqlite3.Cursor:
-        print(f"[+] running sql: {sql_str} {args} {kwargs}")
+        logger.debug("running sql: %s %s %s", sql_str, args, kwargs)
         return self._connector._conn.execute(sql_str, *args, **kwargs)
 
+    def _executemany_sql(self, sql_str: str, rows: List) -> sqlite3.Cursor:
+        logger.debug("running sql: %s (%d rows)", sql_str, len(rows))
+        return self._connector._conn.executemany(sql_str, rows)
+
 
 class StreamDataManager(AbstractDataManager):
     def __init__(
@@ -139,12 +234,18 @@ class StreamDataManager(AbstractDataManager):
         self._data = data.copy()
 
     def save(self) -> None:
-        self._stream.dump(self._data)
+        # other managers share the stream, only write our own branch
+        data = dict(self._stream.load())
+        data[self._prefix] = self._branch
+        self._stream.dump(data)
 
     def upsert(self, model: AbstractModel) -> str:
         model_id, model_data = model.serialize()
         self._branch[model_id] = model_data
 
+    def clear(self) -> None:
+        self._branch.clear()
+
     def delete(self, keyid: Hashable) -> None:
         self.get_or_fail(keyid)
         self._branch.pop(keyid)
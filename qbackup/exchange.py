@@ -0,0 +1,76 @@
+"""
+Import and export of the configuration, as JSON Lines or YAML
+"""
+
+from contextlib import contextmanager
+import json
+from pathlib import Path
+import sys
+from typing import Dict, Iterable, Iterator, TextIO, Tuple
+
+import yaml
+
+FORMATS = ("jsonl", "yaml")
+
+# a model name, e.g. `groups`, and its serialized data
+Record = Tuple[str, Dict]
+
+
+def guess_format(path: str) -> str:
+    if Path(path).suffix in (".yaml", ".yml"):
+        return "yaml"
+    return "jsonl"
+
+
+@contextmanager
+def open_file(path: str, mode: str) -> Iterator[TextIO]:
+    """Open `path`, where `-` stands for standard input or output"""
+    if path == "-":
+        yield sys.stdin if "r" in mode else sys.stdout
+        return
+
+    with open(path, mode) as fp:
+        yield fp
+
+
+def dump(records: Iterable[Record], fp: TextIO, format: str) -> int:
+    """
+    Write `records` to `fp`. JSON Lines are written one record at
+    a time, while YAML is a single document. Returns the record count.
+    """
+    count = 0
+
+    if format == "jsonl":
+        for name, data in records:
+            fp.write(json.dumps({"model": name, "data": data}) + "\n")
+            count += 1
+        return count
+
+    document: Dict[str, list] = {}
+    for name, data in records:
+        document.setdefault(name, []).append(data)
+        count += 1
+    yaml.safe_dump(document, fp, sort_keys=False)
+    return count
+
+
+def load(fp: TextIO, format: str) -> Iterator[Record]:
+    if format == "jsonl":
+        for number, line in enumerate(fp, 1):
+            if not line.strip():
+                continue
+
+            try:
+                record = json.loads(line)
+                yield record["model"], record["data"]
+            except (ValueError, KeyError, TypeError) as err:
+                raise ValueError(f"Invalid record at line {number}") from err
+        return
+
+    document = yaml.safe_load(fp) or {}
+    if not isinstance(document, dict):
+        raise ValueError("Invalid document: expected a mapping of models")
+
+    for name, items in document.items():
+        for data in items or []:
+            yield name, data
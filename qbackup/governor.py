@@ -0,0 +1,212 @@
+"""
+Keeps backups out of the way of interactive use: runs them at a low
+CPU and IO priority, and throttles them while someone uses the machine.
+
+Only the processes started here are governed. In Qubes 4.x `qvm-backup`
+is an Admin API client and qubesd, not its children, runs tar and the
+compression filter, so those are out of reach.
+"""
+
+from dataclasses import dataclass
+from functools import lru_cache
+import logging
+import os
+import signal
+import subprocess
+import time
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+IONICE_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+
+# fraction of the time a throttled backup keeps running, and seconds
+# between checks of the interactive load
+DEFAULT_DUTY = 0.25
+CHECK_INTERVAL = 1.0
+
+
+def ionice_args(value: str) -> List[str]:
+    """`ionice` options of a `CLASS[:LEVEL]` value, e.g. `best-effort:7`"""
+    name, _, level = value.partition(":")
+    if name not in IONICE_CLASSES:
+        raise ValueError(f"Unknown ionice class: {name}")
+
+    args = ["-c", str(IONICE_CLASSES[name])]
+    if level:
+        if not level.isdigit() or int(level) > 7:
+            raise ValueError(f"Invalid ionice level: {level}")
+        args += ["-n", level]
+    return args
+
+
+@lru_cache(maxsize=None)
+def scopes_available() -> bool:
+    """
+    Whether systemd can start transient scopes for this user, which
+    needs a user manager, e.g. not from a system service without one.
+    """
+    try:
+        return subprocess.run(
+            ["systemd-run", "--user", "--scope", "--quiet", "--", "true"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        ).returncode == 0
+    except OSError:
+        return False
+
+
+@dataclass
+class Priority:
+    """
+    Scheduling of the backup processes. Weights are those of the cgroup
+    v2 controllers, 1 to 10000 where 100 is the default, and are set
+    through a transient systemd scope.
+    """
+    nice: Optional[int] = None
+    ionice: Optional[str] = None
+    cpu_weight: Optional[int] = None
+    io_weight: Optional[int] = None
+
+    def command(self, args: List[str]) -> List[str]:
+        """`args` wrapped to run with this priority"""
+        prefix = []
+
+        properties = []
+        if self.cpu_weight is not None:
+            properties += ["-p", f"CPUWeight={self.cpu_weight}"]
+        if self.io_weight is not None:
+            properties += ["-p", f"IOWeight={self.io_weight}"]
+        if properties and not scopes_available():
+            logger.warning("no systemd user manager, ignoring cgroup weights")
+        elif properties:
+            prefix += [
+                "systemd-run", "--user", "--scope", "--quiet",
+                *properties, "--",
+            ]
+
+        # each wrapper execs the next, so the backup keeps their pid
+        if self.ionice:
+            prefix += ["ionice", *ionice_args(self.ionice)]
+        if self.nice is not None:
+            prefix += ["nice", "-n", str(self.nice)]
+
+        return prefix + list(args)
+
+
+def user_idle_seconds() -> Optional[float]:
+    """Seconds since the last input on the desktop, None if unknown"""
+    try:
+        result = subprocess.run(
+            ["xprintidle"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env={"DISPLAY": ":0", **os.environ},
+            check=True,
+            text=True,
+        )
+        return int(result.stdout) / 1000
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+
+def signal_group(process: subprocess.Popen, signum: int) -> None:
+    try:
+        os.killpg(process.pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def wait(process: subprocess.Popen, seconds: float) -> None:
+    try:
+        process.wait(seconds)
+    except subprocess.TimeoutExpired:
+        pass
+
+
+class Governor:
+    """
+    Runs backups at `priority`. When the machine is busy, i.e. the load
+    average per CPU is above `max_load` or the user was active in the
+    last `idle_seconds`, the backup is paused for all but a `duty`
+    fraction of each check interval.
+    """
+
+    def __init__(
+        self,
+        priority: Priority = None,
+        max_load: float = None,
+        idle_seconds: float = None,
+        duty: float = DEFAULT_DUTY,
+        interval: float = CHECK_INTERVAL,
+    ) -> None:
+        if not 0 < duty <= 1:
+            raise ValueError(f"Invalid throttle duty: {duty}")
+
+        self.priority = priority or Priority()
+        self.max_load = max_load
+        self.idle_seconds = idle_seconds
+        self.duty = duty
+        self.interval = interval
+
+    @property
+    def watching(self) -> bool:
+        return self.max_load is not None or bool(self.idle_seconds)
+
+    def busy(self) -> bool:
+        if self.max_load is not None:
+            load = os.getloadavg()[0] / (os.cpu_count() or 1)
+            if load > self.max_load:
+                return True
+
+        if self.idle_seconds:
+            idle = user_idle_seconds()
+            if idle is not None and idle < self.idle_seconds:
+                return True
+
+        return False
+
+    def run(self, args: List[str], input: bytes = None) -> float:
+        """
+        Run `args` to completion, with `input` as its standard input.
+        Returns the seconds it was paused, which is not time the backup
+        stood still when qubesd does the work.
+        """
+        command = self.priority.command(args)
+        if not self.watching:
+            subprocess.run(command, input=input)
+            return 0.0
+
+        # its own process group, to pause the filters it spawns too
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE if input is not None else None,
+            start_new_session=True,
+        )
+        if input is not None:
+            process.stdin.write(input)
+            process.stdin.close()
+
+        throttled = 0.0
+        try:
+            while process.poll() is None:
+                if not self.busy():
+                    wait(process, self.interval)
+                    continue
+
+                signal_group(process, signal.SIGSTOP)
+                paused = time.monotonic()
+                try:
+                    time.sleep(self.interval * (1 - self.duty))
+                finally:
+                    signal_group(process, signal.SIGCONT)
+                    throttled += time.monotonic() - paused
+                wait(process, self.interval * self.duty)
+        except BaseException:
+            # not in the terminal session, so not interrupted with us
+            signal_group(process, signal.SIGTERM)
+            raise
+        finally:
+            process.wait()
+
+        return throttled
@@ -0,0 +1,105 @@
+"""
+Qubes known by the system
+"""
+
+import json
+from pathlib import Path
+import subprocess
+import time
+from typing import Dict, Iterable, List, Optional
+
+from .api import ModelNotFound
+from .metrics import write_atomic
+
+# `qvm-ls` reports disk usage in MiB
+DISK_UNIT = 1024 * 1024
+
+CACHE_NAME = "inventory.json"
+# seconds the cached qube list is trusted
+DEFAULT_TTL = 300
+
+
+def qube_sizes() -> Dict[str, int]:
+    """
+    Disk usage in bytes of every qube, from a single `qvm-ls` call.
+    """
+    result = subprocess.run(
+        ["qvm-ls", "--raw-data", "--fields", "NAME,DISK"],
+        stdout=subprocess.PIPE,
+        check=True,
+        text=True,
+    )
+
+    sizes = {}
+    for line in result.stdout.splitlines():
+        name, _, disk = line.partition("|")
+        try:
+            sizes[name] = int(float(disk) * DISK_UNIT)
+        except ValueError:
+            sizes[name] = 0
+
+    return sizes
+
+
+class Inventory:
+    """
+    Qube sizes of `qube_sizes`, kept for `ttl` seconds in memory and,
+    when `path` is given, in a JSON file shared with later commands.
+    """
+
+    def __init__(self, path: Path = None, ttl: float = DEFAULT_TTL) -> None:
+        self.path = path
+        self.ttl = ttl
+        self._sizes: Optional[Dict[str, int]] = None
+        self._fetched = 0.0
+        # whether the sizes were listed by this process, not the cache
+        self._live = False
+
+    def sizes(self, refresh: bool = False) -> Dict[str, int]:
+        if self._sizes is None and not refresh:
+            self._load()
+
+        if refresh or self._sizes is None \
+                or time.time() - self._fetched > self.ttl:
+            self._sizes = qube_sizes()
+            self._fetched = time.time()
+            self._live = True
+            if self.path is not None:
+                write_atomic(self.path, json.dumps({
+                    "fetched": self._fetched,
+                    "sizes": self._sizes,
+                }) + "\n")
+
+        return self._sizes
+
+    def unknown(self, names: Iterable[str]) -> List[str]:
+        """
+        Names of `names` which are not qubes. Qubes created since the
+        cache was written are found by listing them again, once.
+        """
+        names = list(dict.fromkeys(names))
+        missing = [name for name in names if name not in self.sizes()]
+
+        if missing and not self._live:
+            sizes = self.sizes(refresh=True)
+            missing = [name for name in missing if name not in sizes]
+
+        return missing
+
+    def validate(self, names: Iterable[str]) -> None:
+        """Check all `names` at once, raising ModelNotFound for any unknown"""
+        missing = self.unknown(names)
+        if missing:
+            raise ModelNotFound(f"Unknown qubes: {', '.join(missing)}")
+
+    def _load(self) -> None:
+        if self.path is None:
+            return
+
+        try:
+            cache = json.loads(self.path.read_text())
+            fetched, sizes = float(cache["fetched"]), dict(cache["sizes"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+
+        self._sizes, self._fetched, self._live = sizes, fetched, False
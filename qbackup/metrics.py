@@ -0,0 +1,177 @@
+"""
+Timing spans of backup runs, exported for the node_exporter textfile
+collector and as a JSON trace
+"""
+
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+PREFIX = "qbackup"
+
+# exported gauges: span attribute, metric name and help
+GAUGES = [
+    ("seconds", "stage_duration_seconds", "Wall time of the stage"),
+    ("cpu_seconds", "stage_cpu_seconds",
+     "CPU time of the process and its children during the stage"),
+    ("bytes", "stage_bytes", "Bytes handled by the stage"),
+]
+
+
+@dataclass
+class Span:
+    name: str
+    labels: Dict[str, str] = field(default_factory=dict)
+    parent: Optional[int] = None
+    started: float = 0.0
+    seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    bytes: Optional[int] = None
+    thread: int = 0
+
+
+def cpu_time() -> float:
+    """
+    CPU time of this process and of its waited for children, e.g.
+    qvm-backup and ssh. Work done on their behalf by another process,
+    like the tar and compression run by qubesd, is not accounted.
+    """
+    times = os.times()
+    return (
+        times.user + times.system
+        + times.children_user + times.children_system
+    )
+
+
+class Recorder:
+    """
+    Collects spans, nested by thread. CPU time is process wide, so
+    spans running concurrently each account for the whole process.
+    """
+
+    def __init__(self) -> None:
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def span(self, name: str, **labels: str) -> Iterator[Span]:
+        """Time the block, whose `bytes` may be set through the span"""
+        stack = self._local.__dict__.setdefault("stack", [])
+        span = Span(
+            name,
+            {key: str(value) for key, value in labels.items()},
+            parent=stack[-1] if stack else None,
+            started=time.time(),
+            thread=threading.get_ident(),
+        )
+
+        with self._lock:
+            self.spans.append(span)
+            stack.append(len(self.spans) - 1)
+
+        wall, cpu = time.monotonic(), cpu_time()
+        try:
+            yield span
+        finally:
+            span.seconds = time.monotonic() - wall
+            span.cpu_seconds = cpu_time() - cpu
+            stack.pop()
+
+    def textfile(self, **labels: str) -> str:
+        """
+        Spans in the Prometheus text format, last one of each stage.
+        `labels` are added to every series, to keep them apart from
+        those of other files of the collector.
+        """
+        latest: Dict[Tuple, Span] = {}
+        for span in self.spans:
+            key = (span.name, *sorted(span.labels.items()))
+            latest[key] = span
+
+        lines = []
+        for attribute, metric, description in GAUGES:
+            lines.append(f"# HELP {PREFIX}_{metric} {description}")
+            lines.append(f"# TYPE {PREFIX}_{metric} gauge")
+            for span in latest.values():
+                value = getattr(span, attribute)
+                if value is not None:
+                    series = format_labels({
+                        **labels,
+                        "stage": span.name,
+                        **span.labels,
+                    })
+                    lines.append(f"{PREFIX}_{metric}{{{series}}} {value:g}")
+
+        lines.append(
+            f"# HELP {PREFIX}_last_run_timestamp_seconds "
+            "End of the last recorded run"
+        )
+        lines.append(f"# TYPE {PREFIX}_last_run_timestamp_seconds gauge")
+        lines.append(
+            f"{PREFIX}_last_run_timestamp_seconds{{{format_labels(labels)}}} "
+            f"{time.time():.0f}"
+        )
+        return "\n".join(lines) + "\n"
+
+    def trace(self) -> dict:
+        """Spans as complete events of the Chrome trace event format"""
+        events = []
+        for index, span in enumerate(self.spans):
+            args = {**span.labels, "cpu_seconds": span.cpu_seconds}
+            if span.bytes is not None:
+                args["bytes"] = span.bytes
+            if span.parent is not None:
+                args["parent"] = self.spans[span.parent].name
+
+            events.append({
+                "name": span.name,
+                "ph": "X",
+                "ts": round(span.started * 1e6),
+                "dur": round(span.seconds * 1e6),
+                "pid": os.getpid(),
+                "tid": span.thread,
+                "id": index,
+                "args": args,
+            })
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(
+        self,
+        textfile: Path = None,
+        trace: Path = None,
+        **labels: str,
+    ) -> None:
+        if textfile is not None:
+            write_atomic(Path(textfile), self.textfile(**labels))
+        if trace is not None:
+            write_atomic(Path(trace), json.dumps(self.trace()) + "\n")
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    def escape(value: str) -> str:
+        return (
+            value.replace("\\", "\\\\")
+            .replace("\n", "\\n")
+            .replace('"', '\\"')
+        )
+
+    return ",".join(
+        f'{key}="{escape(value)}"' for key, value in labels.items()
+    )
+
+
+def write_atomic(path: Path, content: str) -> None:
+    """
+    The textfile collector may read at any time, so the file is
+    written aside and renamed over the previous one.
+    """
+    temporary = path.with_name(f".{path.name}.{os.getpid()}")
+    temporary.write_text(content)
+    os.replace(temporary, path)
@@ -12,6 +12,8 @@ from .api import AbstractModel, UUIDModelIdentifier
 class Group(AbstractModel):
     name: str
     period: str
+    compression: str = field(default=None)
+    splittable: bool = field(default=False)
 
     def keyid(self) -> Hashable:
         return self.name
@@ -20,6 +22,8 @@ class Group(AbstractModel):
 @dataclass
 class Period(AbstractModel):
     name: str
+    schedule: str = field(default=None)
+    last_run: str = field(default=None)
 
     def keyid(self) -> Hashable:
         return self.name
@@ -29,3 +33,13 @@ class Period(AbstractModel):
 class Qube(UUIDModelIdentifier, AbstractModel):
     name: str = field(default=None)
     group_name: str = field(default=None)
+
+
+@dataclass
+class Run(UUIDModelIdentifier, AbstractModel):
+    name: str = field(default=None)
+    started: str = field(default=None)
+    seconds: float = field(default=None)
+    input_bytes: int = field(default=None)
+    output_bytes: int = field(default=None)
+    throttled_seconds: float = field(default=None)
@@ -0,0 +1,54 @@
+"""
+Output of model lists, for people and for scripts
+"""
+
+from dataclasses import asdict
+import json
+from pprint import pprint
+import sys
+from typing import Iterable, TextIO
+
+from .api import AbstractModel
+
+FORMATS = ("json", "jsonl", "tsv")
+
+
+def tsv_value(value) -> str:
+    if value is None:
+        return ""
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t") \
+        .replace("\n", "\\n")
+
+
+def print_models(
+    models: Iterable[AbstractModel],
+    format: str = None,
+    fp: TextIO = None,
+) -> None:
+    """
+    Print `models` as they come in a machine readable `format`,
+    or pretty printed when there is none.
+    """
+    fp = fp or sys.stdout
+
+    if format is None:
+        pprint(list(models), stream=fp)
+        return
+
+    if format == "json":
+        fp.write("[")
+        for index, model in enumerate(models):
+            fp.write(",\n " if index else "\n ")
+            fp.write(json.dumps(asdict(model)))
+        fp.write("\n]\n")
+        return
+
+    for index, model in enumerate(models):
+        data = asdict(model)
+        if format == "jsonl":
+            fp.write(json.dumps(data) + "\n")
+            continue
+
+        if not index:
+            fp.write("\t".join(data) + "\n")
+        fp.write("\t".join(tsv_value(value) for value in data.values()) + "\n")
@@ -0,0 +1,408 @@
+"""
+Dom0 backup pipeline: generate the backup, hand it to the carrier VM
+"""
+
+import argparse
+from contextlib import contextmanager
+from datetime import datetime
+import logging
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from . import compression as compression_filters
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# readiness polling: first delay, growth and cap, in seconds
+POLL_INITIAL = 0.1
+POLL_FACTOR = 2
+POLL_MAXIMUM = 5.0
+STAGE_TIMEOUT = 120.0
+
+SECTOR_SIZE = 512
+SYS_BLOCK = Path("/sys/block")
+BACKUP_FILE = "file.backup"
+CARRIER_SERVICE = "qubes.BackupCarrier"
+
+
+class StageTimeout(TimeoutError):
+    pass
+
+
+def wait_for(
+    condition: Callable[[], bool],
+    what: str,
+    timeout: float = STAGE_TIMEOUT,
+) -> float:
+    """
+    Poll `condition` with exponential backoff until it holds.
+    Returns the seconds waited, raises StageTimeout after `timeout`.
+    """
+    started = time.monotonic()
+    deadline = started + timeout
+    delay = POLL_INITIAL
+
+    while not condition():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise StageTimeout(f"{what} not ready after {timeout:.0f}s")
+        time.sleep(min(delay, remaining))
+        delay = min(delay * POLL_FACTOR, POLL_MAXIMUM)
+
+    return time.monotonic() - started
+
+
+def succeeds(*args: str) -> bool:
+    return subprocess.run(
+        args,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    ).returncode == 0
+
+
+def block_users(listing: str, device: str) -> List[str]:
+    """
+    Parse `qvm-block list` output. Returns the qubes `device` is
+    attached to, or None when qubesd does not know about it yet.
+    """
+    for line in listing.splitlines():
+        fields = line.split()
+        if fields and fields[0] == device:
+            return fields[1:]
+    return None
+
+
+def backup_name(prefix: str = "") -> str:
+    return prefix + datetime.now().strftime("%Y-%m-%dT%H%M") + ".backup"
+
+
+class Pipeline:
+    def __init__(
+        self,
+        dest_vm: str,
+        pass_file: str,
+        vms: List[str],
+        name_prefix: str = "",
+        compression: str = compression_filters.DEFAULT_FILTER,
+        shutdown: bool = True,
+        quiet: bool = True,
+        disk_path: str = "/dev/xvdi",
+        timeout: float = STAGE_TIMEOUT,
+        metrics_dir: str = None,
+    ):
+        self.dest_vm = dest_vm
+        self.pass_file = pass_file
+        self.vms = vms
+        self.name_prefix = name_prefix
+        self.compression = compression
+        self.shutdown = shutdown
+        self.quiet = quiet
+        self.disk_path = disk_path
+        self.timeout = timeout
+        self.metrics_dir = metrics_dir
+
+        self.workingdir: Path = None
+        self.block: str = None
+        self.metrics = metrics.Recorder()
+
+    @contextmanager
+    def stage(self, name: str):
+        logger.info("[+] %s", name)
+        with self.metrics.span(name) as span:
+            yield span
+
+        logger.info(
+            "[+] %s took %.1fs (%.1fs cpu)",
+            name,
+            span.seconds,
+            span.cpu_seconds,
+        )
+
+    @property
+    def timings(self) -> Dict[str, float]:
+        return {span.name: span.seconds for span in self.metrics.spans}
+
+    def run(self) -> None:
+        self.workingdir = Path(tempfile.mkdtemp(dir=Path.home()))
+        succeeded = False
+
+        try:
+            notify("Starting backup", critical=True)
+            with self.stage("generating backup") as span:
+                self.generate()
+                span.bytes = self.backup_size
+
+            with self.stage("starting vm"):
+                self.start_vm()
+            with self.stage("creating loop device"):
+                self.create_loop_device()
+            with self.stage("attaching backup disk to vm"):
+                self.attach()
+            with self.stage("waiting for carrier"):
+                self.wait_carrier()
+
+            notify("Transfering backup to VM...")
+            with self.stage("transfering backup") as span:
+                self.transfer()
+                span.bytes = self.backup_size
+
+            notify("Backup completed!", critical=True)
+            succeeded = True
+        finally:
+            self.cleanup(succeeded)
+            logger.info(
+                "[+] timings: %s",
+                ", ".join(f"{k} {v:.1f}s" for k, v in self.timings.items()),
+            )
+            if self.metrics_dir:
+                directory = Path(self.metrics_dir).expanduser()
+                self.metrics.export(
+                    directory / "qbackup-pipeline.prom",
+                    directory / "qbackup-pipeline.trace.json",
+                    run="pipeline",
+                )
+
+    def generate(self) -> None:
+        args = [
+            "qvm-backup", "--yes", "--exclude", "dom0",
+            "--passphrase-file", self.pass_file,
+            *compression_filters.backup_args(self.compression),
+        ]
+
+        # output is syslog, no need for a progress bar
+        if self.quiet:
+            args.append("--quiet")
+
+        subprocess.run(
+            [*args, BACKUP_FILE, *self.vms],
+            cwd=self.workingdir,
+            check=True,
+        )
+
+    def start_vm(self) -> None:
+        subprocess.run(
+            ["qvm-start", "--quiet", "--skip-if-running", self.dest_vm],
+            check=True,
+        )
+        wait_for(
+            lambda: succeeds("qvm-check", "--quiet", "--running", self.dest_vm),
+            f"vm {self.dest_vm}",
+            self.timeout,
+        )
+
+    def create_loop_device(self) -> None:
+        ## IMPORTANT: sets `self.block`, used by cleanup to detach it.
+        path = self.workingdir / BACKUP_FILE
+        self.block = subprocess.run(
+            ["sudo", "losetup", "--show", "-f", str(path)],
+            stdout=subprocess.PIPE,
+            check=True,
+            text=True,
+        ).stdout.strip()
+
+        # with large disks, it takes some time for the block to be
+        # sized and then exposed by qubesd
+        sectors = -(-path.stat().st_size // SECTOR_SIZE)
+        sysfs = SYS_BLOCK / self.device_id / "size"
+        wait_for(
+            lambda: sysfs.exists() and int(sysfs.read_text()) >= sectors,
+            f"loop device {self.block}",
+            self.timeout,
+        )
+        wait_for(
+            lambda: self.block_users() is not None,
+            f"qubesd device {self.device}",
+            self.timeout,
+        )
+
+    def attach(self) -> None:
+        subprocess.run(
+            ["qvm-block", "attach", self.dest_vm, self.device],
+            check=True,
+        )
+        wait_for(
+            lambda: self.dest_vm in (self.block_users() or []),
+            f"attachment of {self.device}",
+            self.timeout,
+        )
+
+    def wait_carrier(self) -> None:
+        wait_for(
+            lambda: succeeds(
+                "qvm-run", "--quiet", "--no-gui", "--pass-io",
+                self.dest_vm, f"test -b {self.disk_path}",
+            ),
+            f"disk {self.disk_path} in {self.dest_vm}",
+            self.timeout,
+        )
+
+    def transfer(self) -> None:
+        path = backup_name(self.name_prefix)
+        logger.info("[+] notifying vm about backup %s", path)
+        subprocess.run(
+            ["qvm-run", "--pass-io", "--service", self.dest_vm,
+             CARRIER_SERVICE],
+            input=f"{path}\n".encode(),
+            check=True,
+        )
+
+    def cleanup(self, succeeded: bool) -> None:
+        if self.workingdir and self.workingdir.is_dir():
+            logger.info("[+] removing backup")
+            shutil.rmtree(self.workingdir, ignore_errors=True)
+
+        if self.block:
+            logger.info("[+] detaching disk")
+            subprocess.run(["qvm-block", "detach", self.dest_vm, self.device])
+            subprocess.run(["sudo", "losetup", "-d", self.block])
+
+        if self.shutdown:
+            logger.info("[+] shutting vm down")
+            subprocess.run(
+                ["qvm-shutdown", "--quiet", "--wait", self.dest_vm]
+            )
+
+        if not succeeded:
+            notify("Failure on backup. Check your logs", critical=True)
+
+    @property
+    def backup_size(self) -> int:
+        return (self.workingdir / BACKUP_FILE).stat().st_size
+
+    @property
+    def device_id(self) -> str:
+        return os.path.basename(self.block)
+
+    @property
+    def device(self) -> str:
+        return f"dom0:{self.device_id}"
+
+    def block_users(self) -> List[str]:
+        result = subprocess.run(
+            ["qvm-block", "list"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        return block_users(result.stdout, self.device)
+
+
+def notify(message: str, critical: bool = False) -> None:
+    args = ["notify-send"]
+    if critical:
+        args += ["-u", "critical"]
+    subprocess.run([*args, "Automated Backup", message])
+
+
+def redirect_to_syslog() -> None:
+    """Send all output, ours and of subprocesses, to `logger`"""
+    syslog = subprocess.Popen(
+        ["logger", "--tag", "qbackup"],
+        stdin=subprocess.PIPE,
+    )
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(syslog.stdin.fileno(), sys.stdout.fileno())
+    os.dup2(syslog.stdin.fileno(), sys.stderr.fileno())
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="qbackup")
+    parser.add_argument(
+        "-t",
+        dest="dest_vm",
+        default=os.environ.get("QBKP_DEST_VM"),
+        help="VM with the carrier service (env: QBKP_DEST_VM)",
+    )
+    parser.add_argument(
+        "-p",
+        dest="pass_file",
+        default=os.environ.get("QBKP_PASS_FILE"),
+        help="Backup passphrase file (env: QBKP_PASS_FILE)",
+    )
+    parser.add_argument("-f", dest="name_prefix", default="")
+    parser.add_argument(
+        "-z",
+        dest="compression",
+        default=os.environ.get(
+            "QBKP_COMPRESSION", compression_filters.DEFAULT_FILTER
+        ),
+        help="Compression filter (env: QBKP_COMPRESSION)",
+    )
+    parser.add_argument(
+        "-o",
+        dest="syslog",
+        action="store_false",
+        help="Write output to stdout instead of syslog",
+    )
+    parser.add_argument(
+        "-x",
+        dest="shutdown",
+        action="store_false",
+        help="Keep the destination vm running",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=float(os.environ.get("QBKP_STAGE_TIMEOUT", STAGE_TIMEOUT)),
+        help="Seconds to wait for each stage to be ready "
+             "(env: QBKP_STAGE_TIMEOUT)",
+    )
+    parser.add_argument(
+        "--metrics-dir",
+        default=os.environ.get("QBKP_METRICS_DIR"),
+        help="Write stage metrics to this directory, e.g. the node_exporter "
+             "textfile collector one (env: QBKP_METRICS_DIR)",
+    )
+    parser.add_argument("vms", nargs="*")
+
+    args = parser.parse_args(argv)
+    if not args.dest_vm or not args.pass_file:
+        parser.print_usage()
+        sys.exit(128)
+
+    return args
+
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(argv)
+
+    if args.syslog:
+        redirect_to_syslog()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    pipeline = Pipeline(
+        args.dest_vm,
+        args.pass_file,
+        args.vms,
+        name_prefix=args.name_prefix,
+        compression=args.compression,
+        shutdown=args.shutdown,
+        quiet=args.syslog,
+        disk_path=os.environ.get("DISK_PATH", "/dev/xvdi"),
+        timeout=args.timeout,
+        metrics_dir=args.metrics_dir,
+    )
+
+    try:
+        pipeline.run()
+    except StageTimeout as error:
+        logger.error("[-] %s", error)
+        return 4
+    except subprocess.CalledProcessError as error:
+        logger.error("[-] backup just failed! %s", error)
+        return 5
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
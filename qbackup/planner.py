@@ -0,0 +1,163 @@
+"""
+Planning of backup runs: estimates and packing into concurrent jobs
+"""
+
+import heapq
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .models import Run
+
+# guesses used until there is history to learn from
+DEFAULT_THROUGHPUT = 50 * 1000 ** 2
+DEFAULT_RATIO = 0.6
+DEFAULT_RATIOS = {"none": 1.0}
+
+
+@dataclass
+class Estimate:
+    input_bytes: int
+    output_bytes: int
+    seconds: float
+
+
+@dataclass(frozen=True)
+class Unit:
+    """Qubes which must be backed up by the same job"""
+    group: str
+    qubes: Tuple[str, ...]
+    size: int
+
+
+@dataclass
+class Job:
+    units: List[Unit] = field(default_factory=list)
+
+    @property
+    def size(self) -> int:
+        return sum(unit.size for unit in self.units)
+
+    @property
+    def qubes(self) -> List[str]:
+        return [qube for unit in self.units for qube in unit.qubes]
+
+    @property
+    def main_group(self) -> str:
+        """Group holding most of the job data, which lends its settings"""
+        sizes: Dict[str, int] = {}
+        for unit in self.units:
+            sizes[unit.group] = sizes.get(unit.group, 0) + unit.size
+        return max(sizes, key=lambda group: (sizes[group], group))
+
+
+def plan_units(
+    members: Dict[str, Iterable[str]],
+    sizes: Dict[str, int],
+    splittable: Set[str] = frozenset(),
+) -> List[Unit]:
+    """
+    Split groups `members` into the units the planner may move around.
+    Groups are kept whole, unless they are `splittable`, in which case
+    every qube is a unit of its own. Qubes of unknown size count as empty.
+    """
+    units = []
+
+    for group, qubes in members.items():
+        qubes = tuple(qubes)
+        if not qubes:
+            continue
+
+        if group in splittable:
+            units.extend(
+                Unit(group, (qube,), sizes.get(qube, 0))
+                for qube in qubes
+            )
+        else:
+            units.append(
+                Unit(group, qubes, sum(sizes.get(qube, 0) for qube in qubes))
+            )
+
+    return units
+
+
+def pack(units: Iterable[Unit], jobs: int) -> List[Job]:
+    """
+    Pack `units` into at most `jobs` jobs of balanced size, so running
+    them concurrently takes as little wall time as possible.
+
+    Uses the longest processing time first heuristic: the largest units
+    are placed first, each on the job with the least data so far. The
+    largest job is at most 4/3 of the optimal one.
+    """
+    if jobs < 1:
+        raise ValueError(f"Invalid number of jobs: {jobs}")
+
+    plan = [Job() for _ in range(jobs)]
+
+    # (size, index) so ties go to the first job, keeping plans stable
+    loads = [(0, index) for index in range(jobs)]
+
+    ordered = sorted(units, key=lambda unit: (-unit.size, unit.group, unit.qubes))
+    for unit in ordered:
+        size, index = heapq.heappop(loads)
+        plan[index].units.append(unit)
+        heapq.heappush(loads, (size + unit.size, index))
+
+    return [job for job in plan if job.units]
+
+
+def group_runs(run: Run, job: Job) -> List[Run]:
+    """
+    Split the `run` of a `job` into a run of each of its groups, each
+    with a share of the measures as large as its share of the job data
+    """
+    sizes: Dict[str, int] = {}
+    for unit in job.units:
+        sizes[unit.group] = sizes.get(unit.group, 0) + unit.size
+    total = sum(sizes.values())
+
+    runs = []
+    for group, size in sizes.items():
+        fraction = size / total if total else 1 / len(sizes)
+        runs.append(Run(
+            name=group,
+            started=run.started,
+            seconds=run.seconds and run.seconds * fraction,
+            input_bytes=size,
+            output_bytes=run.output_bytes and int(run.output_bytes * fraction),
+            throttled_seconds=(
+                run.throttled_seconds and run.throttled_seconds * fraction
+            ),
+        ))
+    return runs
+
+
+def estimate(
+    input_bytes: int,
+    runs: Iterable[Run],
+    compression_filter: Optional[str] = None,
+) -> Estimate:
+    """
+    Estimate output size and duration of a backup of `input_bytes`,
+    from the throughput and compression ratio of past `runs`.
+    """
+    runs = list(runs)
+
+    # paused time stays in: qubesd keeps working while qvm-backup is paused
+    timed = [run for run in runs if run.seconds and run.input_bytes]
+    throughput = DEFAULT_THROUGHPUT
+    if timed:
+        throughput = sum(run.input_bytes for run in timed) / \
+            sum(run.seconds for run in timed)
+
+    sized = [run for run in runs if run.output_bytes and run.input_bytes]
+    ratio = DEFAULT_RATIOS.get(compression_filter, DEFAULT_RATIO)
+    if sized:
+        ratio = sum(run.output_bytes for run in sized) / \
+            sum(run.input_bytes for run in sized)
+
+    return Estimate(
+        input_bytes,
+        int(input_bytes * ratio),
+        input_bytes / throughput,
+    )
@@ -0,0 +1,119 @@
+"""
+Cron-style schedules of backup periods
+"""
+
+from datetime import datetime, timedelta
+from typing import Set
+
+ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+    "@yearly": "0 0 1 1 *",
+}
+
+# name, lowest and highest value of each schedule field
+FIELDS = [
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 7),
+]
+
+# give up looking for a next run after this many years, e.g. `0 0 30 2 *`
+MAX_YEARS = 5
+
+
+def parse_field(value: str, lowest: int, highest: int) -> Set[int]:
+    """
+    Parse a single cron field: `*`, `a`, `a-b`, with an optional `/step`,
+    or a comma separated list of those.
+    """
+    values = set()
+
+    for item in value.split(","):
+        item_range, _, step = item.partition("/")
+
+        if item_range == "*":
+            start, end = lowest, highest
+        elif "-" in item_range:
+            start, end = map(int, item_range.split("-"))
+        else:
+            start = end = int(item_range)
+
+        if start < lowest or end > highest or start > end:
+            raise ValueError(f"Value out of range: {item}")
+
+        values.update(range(start, end + 1, int(step or 1)))
+
+    return values
+
+
+class CronSchedule:
+    def __init__(self, expression: str) -> None:
+        self.expression = expression
+
+        fields = ALIASES.get(expression, expression).split()
+        if len(fields) != len(FIELDS):
+            raise ValueError(f"Invalid schedule: {expression}")
+
+        (
+            self.minutes,
+            self.hours,
+            self.days,
+            self.months,
+            weekdays,
+        ) = [
+            parse_field(value, lowest, highest)
+            for value, (_, lowest, highest) in zip(fields, FIELDS)
+        ]
+
+        # both 0 and 7 are sunday
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+
+        # as in cron, when both day fields are restricted either may match
+        self._days_restricted = fields[2] != "*"
+        self._weekdays_restricted = fields[4] != "*"
+
+    def next_after(self, when: datetime) -> datetime:
+        """
+        First time strictly after `when` matching the schedule.
+        """
+        candidate = when.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = when + timedelta(days=366 * MAX_YEARS)
+
+        while candidate < limit:
+            if candidate.month not in self.months:
+                candidate = self._next_month(candidate)
+            elif not self._matches_day(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + \
+                    timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+
+        raise ValueError(f"Schedule never runs: {self.expression}")
+
+    def _matches_day(self, when: datetime) -> bool:
+        day = when.day in self.days
+        # cron counts weekdays from sunday, python from monday
+        weekday = (when.weekday() + 1) % 7 in self.weekdays
+
+        if self._days_restricted and self._weekdays_restricted:
+            return day or weekday
+        return day and weekday
+
+    @staticmethod
+    def _next_month(when: datetime) -> datetime:
+        first_day = when.replace(day=1, hour=0, minute=0)
+        if first_day.month == 12:
+            return first_day.replace(year=first_day.year + 1, month=1)
+        return first_day.replace(month=first_day.month + 1)
+
+    def __repr__(self) -> str:
+        return f"CronSchedule({self.expression!r})"
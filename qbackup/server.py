@@ -0,0 +1,184 @@
+"""
+Resident command server over a Unix socket, and its thin client
+
+The client only needs the standard library, so forwarding a command
+costs neither the imports nor the datastore setup of the full CLI.
+"""
+
+from contextlib import redirect_stderr, redirect_stdout
+import io
+import json
+import os
+from pathlib import Path
+import socket
+import struct
+import sys
+from typing import Callable, List, Optional
+
+SOCKET_NAME = "qbackup.sock"
+DEFAULT_CONFIG = "~/.config/qbackup"
+
+# pid, uid and gid of the peer, as returned by SO_PEERCRED
+PEERCRED = struct.Struct("3i")
+
+
+class Frames(io.TextIOBase):
+    """Text stream forwarded to the client, one frame per write"""
+
+    def __init__(self, fp, stream: str) -> None:
+        self.fp = fp
+        self.stream = stream
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: str) -> int:
+        if data:
+            send(self.fp, {self.stream: data})
+        return len(data)
+
+
+def send(fp, message: dict) -> None:
+    fp.write(json.dumps(message) + "\n")
+    fp.flush()
+
+
+def socket_path(argv: List[str]) -> Path:
+    """
+    Socket of the configuration directory chosen in `argv`, found
+    without parsing the whole command line.
+    """
+    config = DEFAULT_CONFIG
+    for index, arg in enumerate(argv):
+        if arg in ("-c", "--config") and index + 1 < len(argv):
+            config = argv[index + 1]
+        elif arg.startswith("--config="):
+            config = arg.partition("=")[2]
+
+    return Path(config).expanduser() / SOCKET_NAME
+
+
+def peer_uid(conn: socket.socket) -> int:
+    credentials = conn.getsockopt(
+        socket.SOL_SOCKET,
+        socket.SO_PEERCRED,
+        PEERCRED.size,
+    )
+    _, uid, _ = PEERCRED.unpack(credentials)
+    return uid
+
+
+def request(path: Path, argv: List[str]) -> Optional[int]:
+    """
+    Run `argv` in the server listening at `path`, forwarding its output.
+    Returns the exit status, or None when the command must run in-process.
+    """
+    try:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(str(path))
+    except OSError:
+        conn.close()
+        return None
+
+    with conn, conn.makefile("rw") as fp:
+        send(fp, {"argv": argv, "cwd": os.getcwd()})
+
+        for line in fp:
+            message = json.loads(line)
+            if "stdout" in message:
+                sys.stdout.write(message["stdout"])
+            elif "stderr" in message:
+                sys.stderr.write(message["stderr"])
+            elif message.get("fallback"):
+                return None
+            else:
+                sys.stdout.flush()
+                return message["status"]
+
+    # the server went away in the middle of the command
+    return 1
+
+
+def serve(path: Path, execute: Callable[[List[str]], Optional[int]]) -> None:
+    """
+    Serve commands one at a time until interrupted. Only processes of
+    the same user are served. `execute` runs a command line, returning
+    its exit status or None when it must run in the client instead.
+    """
+    if path.exists():
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(path))
+        except OSError:
+            path.unlink()
+        else:
+            raise RuntimeError(f"A server is already listening at {path}")
+        finally:
+            probe.close()
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    try:
+        listener.bind(str(path))
+    finally:
+        os.umask(old_umask)
+
+    listener.listen()
+    try:
+        while True:
+            conn, _ = listener.accept()
+            with conn, conn.makefile("rw") as fp:
+                handle(conn, fp, execute)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        path.unlink(missing_ok=True)
+
+
+def handle(conn: socket.socket, fp, execute: Callable) -> None:
+    if peer_uid(conn) != os.getuid():
+        send(fp, {"stderr": "Permission denied\n"})
+        send(fp, {"status": 77})
+        return
+
+    try:
+        message = json.loads(fp.readline())
+        argv, cwd = list(message["argv"]), message["cwd"]
+    except (ValueError, KeyError, TypeError):
+        return
+
+    workdir = os.getcwd()
+    try:
+        os.chdir(cwd)
+    except OSError as err:
+        send(fp, {"stderr": f"Cannot run in {cwd}: {err.strerror}\n"})
+        send(fp, {"status": 1})
+        return
+
+    try:
+        with redirect_stdout(Frames(fp, "stdout")), \
+                redirect_stderr(Frames(fp, "stderr")):
+            status = execute(argv)
+    except BrokenPipeError:
+        return
+    finally:
+        os.chdir(workdir)
+
+    if status is None:
+        send(fp, {"fallback": True})
+    else:
+        send(fp, {"status": status})
+
+
+def main(argv: List[str] = None) -> int:
+    """Forward the command to a running server, or run it in-process"""
+    argv = sys.argv[1:] if argv is None else argv
+
+    status = request(socket_path(argv), argv)
+    if status is not None:
+        return status
+
+    from . import cli
+    cli.main(argv)
+    return 0
@@ -0,0 +1,307 @@
+"""
+End to end throughput benchmark over the fake Qubes toolkit
+
+Backs synthetic groups of 1, 10 and 100 GB up, through the dom0
+pipeline (`qbackup`) or the `qbackup run` path, and reports the
+throughput, the time of each stage and the peak memory of each
+process. Everything runs locally, so results show the overhead of
+qbackup itself rather than of the disks and the network:
+
+    python -m tests.benchmark --sizes 1,10 --workdir /var/tmp/bench
+
+The pipeline keeps the backup file in dom0 and a copy on the server,
+so it needs about twice the group size of free space in `--workdir`.
+"""
+
+import argparse
+from contextlib import contextmanager
+import json
+import logging
+import os
+from pathlib import Path
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, Iterator, List
+
+from qbackup import cli, pipeline
+from qbackup.pipeline import Pipeline
+from tests.fakequbes import FakeQubes
+
+GB = 1000 ** 3
+MB = 1000 ** 2
+MiB = 1024 * 1024
+CARRIER_VM = "backups"
+# `qbackup run` backs groups up through this qube
+RUN_VM = "home-backups"
+SERVER = "server"
+
+
+class MemorySampler(threading.Thread):
+    """
+    Peak resident memory of this process and its descendants, by
+    component, polled from /proc
+    """
+
+    def __init__(self, interval: float = 0.2) -> None:
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peaks: Dict[str, int] = {}
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        while not self._done.wait(self.interval):
+            self.sample()
+
+    def stop(self) -> Dict[str, int]:
+        self._done.set()
+        self.join()
+        self.sample()
+        return self.peaks
+
+    def sample(self) -> None:
+        for pid in descendants(os.getpid()):
+            try:
+                argv = read_proc(pid, "cmdline").split("\0")
+                status = read_proc(pid, "status")
+            except OSError:
+                continue
+
+            for line in status.splitlines():
+                if line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+                    name = component(pid, argv)
+                    self.peaks[name] = max(self.peaks.get(name, 0), peak)
+
+
+def read_proc(pid: int, name: str) -> str:
+    with open(f"/proc/{pid}/{name}") as fp:
+        return fp.read()
+
+
+def descendants(root: int) -> List[int]:
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            # the command name, in parentheses, may contain spaces
+            stat = read_proc(int(entry), "stat")
+        except OSError:
+            continue
+        ppid = int(stat.rpartition(")")[2].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+
+    found, pending = [], [root]
+    while pending:
+        pid = pending.pop()
+        found.append(pid)
+        pending.extend(children.get(pid, []))
+    return found
+
+
+def component(pid: int, argv: List[str]) -> str:
+    if pid == os.getpid():
+        return "qbackup"
+    for arg in argv[:2]:
+        name = Path(arg).name
+        if name in ("qbackup-carrier", "qbackup-shell"):
+            return name
+        if name == "fakequbes.py" and len(argv) > 2:
+            return f"fake {argv[2]}"
+    return Path(argv[0]).name
+
+
+@contextmanager
+def environment(variables: Dict[str, str]) -> Iterator[None]:
+    saved = {name: os.environ.get(name) for name in variables}
+    os.environ.update(variables)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def stage_seconds(trace: Path) -> Dict[str, float]:
+    """Seconds spent in each stage, summed over groups"""
+    seconds: Dict[str, float] = {}
+    for event in json.loads(trace.read_text())["traceEvents"]:
+        seconds[event["name"]] = (
+            seconds.get(event["name"], 0) + event["dur"] / 1e6
+        )
+    return seconds
+
+
+def run_pipeline(qubes: FakeQubes, vms: List[str], args) -> Path:
+    passphrase = qubes.root / "passphrase"
+    passphrase.write_text("benchmark\n")
+
+    Pipeline(
+        CARRIER_VM,
+        str(passphrase),
+        vms,
+        compression=args.compression,
+        metrics_dir=str(qubes.root),
+    ).run()
+    return qubes.root / "qbackup-pipeline.trace.json"
+
+
+def run_cli(qubes: FakeQubes, vms: List[str], args) -> Path:
+    config = str(qubes.root / "config")
+    for argv in (
+        ["period", "add", "benchmark"],
+        ["group", "add", "bench", "benchmark",
+         "--compression", args.compression],
+        ["qube", "add", "bench", *vms],
+        ["run", "benchmark", "--metrics-dir", str(qubes.root)],
+    ):
+        cli.main(["-c", config, *argv])
+    return qubes.root / "qbackup-benchmark.trace.json"
+
+
+def benchmark(size: int, workdir: Path, args) -> dict:
+    """Back a group of `size` bytes up. Returns the measurements"""
+    qubes = FakeQubes(workdir / f"{size / GB:g}G")
+    variables = qubes.install()
+    dom0 = qubes.root / "dom0"
+    dom0.mkdir(exist_ok=True)
+
+    vms = [f"bench{index}" for index in range(args.qubes)]
+    for index, vm in enumerate(vms):
+        qubes.add_qube(vm, size // args.qubes + (index < size % args.qubes))
+
+    carrier = {
+        "QBKP_STREAMS": str(args.streams),
+        "QBKP_DIRECT": "1" if args.direct else "0",
+    }
+    qubes.add_qube(CARRIER_VM, ssh_conn=SERVER, environment=carrier)
+    qubes.add_qube(RUN_VM, ssh_conn=SERVER)
+
+    variables.update({
+        "HOME": str(dom0),
+        "FAKEQUBES_RATE": str(args.rate * MB),
+        "FAKEQUBES_COMPRESSIBILITY": str(args.compressibility),
+    })
+    run = run_cli if args.mode == "run" else run_pipeline
+
+    sampler = MemorySampler()
+    with environment(variables):
+        pipeline.SYS_BLOCK = qubes.root / "sys" / "block"
+        sampler.start()
+        started = time.monotonic()
+        try:
+            trace = run(qubes, vms, args)
+        finally:
+            seconds = time.monotonic() - started
+            peaks = sampler.stop()
+
+    stored = sum(
+        path.stat().st_size
+        for path in qubes.server(SERVER).glob("*.backup")
+    )
+    result = {
+        "size": size,
+        "stored": stored,
+        "seconds": seconds,
+        "throughput": size / seconds,
+        "stages": stage_seconds(trace),
+        "peak_rss": peaks,
+    }
+
+    if not args.keep:
+        shutil.rmtree(qubes.root)
+    return result
+
+
+def report(result: dict) -> None:
+    print(
+        f"[+] {result['size'] / GB:g} GB in {result['seconds']:.1f}s: "
+        f"{result['throughput'] / MB:.1f} MB/s, "
+        f"{result['stored'] / GB:.2f} GB stored"
+    )
+    for name, seconds in result["stages"].items():
+        print(f"    {name:<30} {seconds:8.1f}s")
+    for name, peak in sorted(result["peak_rss"].items()):
+        print(f"    peak rss {name:<21} {peak / MiB:8.1f} MiB")
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m tests.benchmark")
+    parser.add_argument(
+        "--sizes",
+        default="1,10,100",
+        help="Comma separated group sizes, in GB",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["pipeline", "run"],
+        default="pipeline",
+        help="Back up through the dom0 pipeline or `qbackup run`",
+    )
+    parser.add_argument("--qubes", type=int, default=4,
+                        help="Qubes of the group")
+    parser.add_argument("--compression", default="none",
+                        help="Compression filter, or `none`")
+    parser.add_argument("--compressibility", type=float, default=0.5,
+                        help="Fraction of zero bytes in the qube data")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="qvm-backup speed in MB/s, 0 for unlimited")
+    parser.add_argument("--streams", type=int, default=1,
+                        help="Concurrent carrier uploads")
+    parser.add_argument("--direct", action="store_true",
+                        help="Carrier reads bypass the page cache")
+    parser.add_argument("--workdir", type=Path,
+                        help="Directory of the fake systems, "
+                             "default a temporary one in /var/tmp")
+    parser.add_argument("--keep", action="store_true",
+                        help="Keep the fake systems, and their backups")
+    parser.add_argument("--json", type=Path,
+                        help="Also write the results to this file")
+    parser.add_argument("--verbose", "-v", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(message)s",
+    )
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(dir="/var/tmp"))
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    results = []
+    try:
+        for size in [int(float(gb) * GB) for gb in args.sizes.split(",")]:
+            # the pipeline holds the backup in dom0 and on the server
+            needed = size * (2 if args.mode == "pipeline" else 1)
+            free = shutil.disk_usage(workdir).free
+            if free < needed:
+                print(
+                    f"[-] skipping {size / GB:g} GB: needs "
+                    f"{needed / GB:.0f} GB, {free / GB:.0f} GB free "
+                    f"in {workdir}",
+                    file=sys.stderr,
+                )
+                continue
+
+            results.append(benchmark(size, workdir, args))
+            report(results[-1])
+    finally:
+        if not args.workdir and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,598 @@
+"""
+Stand-ins for the Qubes tools qbackup drives, to run it end to end
+outside of dom0
+
+`FakeQubes.install` writes a wrapper per tool into a bin directory,
+each running this module with the tool name. The state of the fake
+system lives under FAKEQUBES_ROOT:
+
+    state.json          qubes, loop devices and block attachments
+    sys/block/loopN     sizes of the loop devices, as in sysfs
+    vms/NAME            home of each qube, and its dev/xvdi link
+    servers/HOST        home of the backup user on each ssh server
+    servers/HOST.state  state directory of qbackup-shell on each server
+    notifications.log   notify-send calls
+    syslog              output sent to logger
+
+Qubes run their commands as local processes with their own home, and
+the ssh servers run src/qbackup-shell over a pipe.
+"""
+
+import argparse
+from contextlib import contextmanager
+import fcntl
+import io
+import json
+import os
+from pathlib import Path
+import shlex
+import subprocess
+import sys
+import tarfile
+import time
+from typing import Dict, Iterator, List
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+
+TOOLS = [
+    "qvm-backup",
+    "qvm-run",
+    "qvm-block",
+    "qvm-start",
+    "qvm-shutdown",
+    "qvm-check",
+    "qvm-ls",
+    "notify-send",
+    "logger",
+    "losetup",
+    "sudo",
+    "ssh",
+]
+
+SECTOR_SIZE = 512
+# synthetic data: pool of random bytes, block of mixed random and zero
+# bytes and archive member size, as qvm-backup splits images in chunks
+POOL_SIZE = 4 * 1024 * 1024
+BLOCK_SIZE = 64 * 1024
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+class FakeQubes:
+    """Fake dom0 rooted at `root`"""
+
+    def __init__(self, root: Path) -> None:
+        self.root = Path(root)
+        self.bin = self.root / "bin"
+
+    def install(self) -> Dict[str, str]:
+        """
+        Write the tool wrappers. Returns the environment variables
+        making them the ones run by qbackup.
+        """
+        self.bin.mkdir(parents=True, exist_ok=True)
+        for tool in TOOLS:
+            wrapper = self.bin / tool
+            wrapper.write_text(
+                "#!/bin/sh\n"
+                f"exec {shlex.quote(sys.executable)} "
+                f"{shlex.quote(str(Path(__file__).resolve()))} "
+                f"{tool} \"$@\"\n"
+            )
+            wrapper.chmod(0o755)
+
+        if not (self.root / "state.json").exists():
+            self.save({"qubes": {}, "loops": {}, "attached": {}})
+
+        return {
+            "FAKEQUBES_ROOT": str(self.root),
+            "PATH": os.pathsep.join([
+                str(self.bin),
+                str(SRC_DIR),
+                os.environ.get("PATH", os.defpath),
+            ]),
+        }
+
+    def add_qube(
+        self,
+        name: str,
+        disk: int = 0,
+        ssh_conn: str = None,
+        environment: Dict[str, str] = None,
+        klass: str = "AppVM",
+    ) -> Path:
+        """
+        Add a qube with a private volume of `disk` bytes. A carrier
+        qube gets `ssh_conn` and `environment` in its ~/.bash_profile.
+        Returns its home.
+        """
+        with self.state() as state:
+            state["qubes"][name] = {
+                "disk": disk,
+                "class": klass,
+                "running": False,
+            }
+
+        home = self.home(name)
+        home.mkdir(parents=True, exist_ok=True)
+        profile = dict(environment or {})
+        if ssh_conn is not None:
+            profile["SSH_CONN"] = ssh_conn
+        (home / ".bash_profile").write_text("".join(
+            f"export {key}={shlex.quote(value)}\n"
+            for key, value in profile.items()
+        ))
+        return home
+
+    def home(self, vm: str) -> Path:
+        return self.root / "vms" / vm / "home"
+
+    def server(self, host: str) -> Path:
+        """Home of the backup user on `host`"""
+        return self.root / "servers" / host.replace("/", "_")
+
+    def load(self) -> dict:
+        return json.loads((self.root / "state.json").read_text())
+
+    def save(self, state: dict) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        temporary = self.root / f".state.json.{os.getpid()}"
+        temporary.write_text(json.dumps(state, indent=1))
+        os.replace(temporary, self.root / "state.json")
+
+    @contextmanager
+    def state(self) -> Iterator[dict]:
+        """Read, then write back, the state under a lock"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / "state.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = self.load() if (self.root / "state.json").exists() \
+                else {"qubes": {}, "loops": {}, "attached": {}}
+            yield state
+            self.save(state)
+
+    def log(self, name: str, line: str) -> None:
+        with open(self.root / name, "a") as fp:
+            fp.write(line.rstrip("\n") + "\n")
+
+    def vm_environment(self, vm: str) -> Dict[str, str]:
+        """Environment of processes running in `vm`"""
+        return {
+            **os.environ,
+            "HOME": str(self.home(vm)),
+            "DISK_PATH": str(self.xvdi(vm)),
+        }
+
+    def xvdi(self, vm: str) -> Path:
+        """Block device attached to `vm`, a link to the backing file"""
+        return self.root / "vms" / vm / "dev" / "xvdi"
+
+    def running(self, vm: str) -> bool:
+        qube = self.load()["qubes"].get(vm)
+        return bool(qube and qube["running"])
+
+
+def fake() -> FakeQubes:
+    return FakeQubes(Path(os.environ["FAKEQUBES_ROOT"]))
+
+
+def fail(message: str, status: int = 1) -> int:
+    print(f"{Path(sys.argv[1]).name}: error: {message}", file=sys.stderr)
+    return status
+
+
+def start(qubes: FakeQubes, vm: str) -> bool:
+    """Start `vm` if it exists. Returns whether it was started"""
+    with qubes.state() as state:
+        if vm not in state["qubes"]:
+            return False
+        state["qubes"][vm]["running"] = True
+    return True
+
+
+def synthetic(size: int, compressibility: float) -> Iterator[bytes]:
+    """
+    `size` bytes, of which a `compressibility` fraction are zeros.
+    Random bytes are drawn from a pool, so generating is cheap.
+    """
+    pool = os.urandom(POOL_SIZE)
+    random_size = round(BLOCK_SIZE * (1 - compressibility))
+    zeros = bytes(BLOCK_SIZE - random_size)
+    offset = 0
+
+    while size > 0:
+        blocks = []
+        for _ in range(min(CHUNK_SIZE, size) // BLOCK_SIZE + 1):
+            offset = (offset + 7919 * 64) % (POOL_SIZE - random_size)
+            blocks.append(pool[offset:offset + random_size] + zeros)
+
+        chunk = b"".join(blocks)[:min(CHUNK_SIZE, size)]
+        size -= len(chunk)
+        yield chunk
+
+
+def paced(chunks: Iterator[bytes], rate: float) -> Iterator[bytes]:
+    """Yield `chunks` no faster than `rate` bytes per second"""
+    started, sent = time.monotonic(), 0
+    for chunk in chunks:
+        sent += len(chunk)
+        if rate > 0:
+            ahead = started + sent / rate - time.monotonic()
+            if ahead > 0:
+                time.sleep(ahead)
+        yield chunk
+
+
+def add_member(archive: tarfile.TarFile, name: str, data: bytes) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    archive.addfile(info, io.BytesIO(data))
+
+
+def qvm_backup(argv: List[str]) -> int:
+    """
+    Write a backup archive of the qubes' private volumes: a tar of
+    chunked members, each through the compression filter. Data is
+    synthetic, generated at FAKEQUBES_RATE bytes per second (default
+    unlimited) with a FAKEQUBES_COMPRESSIBILITY fraction (default 0.5)
+    of zero bytes.
+    """
+    parser = argparse.ArgumentParser(prog="qvm-backup")
+    parser.add_argument("--yes", "-y", action="store_true")
+    parser.add_argument("--quiet", "-q", action="store_true")
+    parser.add_argument("--exclude", "-x", action="append", default=[])
+    parser.add_argument("--passphrase-file", "-p")
+    parser.add_argument("--dest-vm", "-d")
+    compress = parser.add_mutually_exclusive_group()
+    compress.add_argument("--compress", "-z", action="store_true")
+    compress.add_argument("--no-compress", action="store_true")
+    compress.add_argument("--compress-filter", "-Z")
+    parser.add_argument("destination")
+    parser.add_argument("vms", nargs="*")
+    args = parser.parse_args(argv)
+
+    qubes = fake()
+    known = qubes.load()["qubes"]
+    vms = [vm for vm in args.vms if vm not in args.exclude]
+    for vm in vms:
+        if vm not in known:
+            return fail(f"no such domain: '{vm}'")
+
+    if args.passphrase_file:
+        Path(args.passphrase_file).read_text()
+    else:
+        sys.stdin.readline()
+
+    if args.compress_filter:
+        command = [args.compress_filter]
+    elif args.no_compress:
+        command = None
+    else:
+        command = ["gzip"]
+
+    rate = float(os.environ.get("FAKEQUBES_RATE", 0))
+    compressibility = float(os.environ.get("FAKEQUBES_COMPRESSIBILITY", 0.5))
+
+    if args.dest_vm:
+        if not start(qubes, args.dest_vm):
+            return fail(f"no such domain: '{args.dest_vm}'")
+        receiver = subprocess.Popen(
+            ["sh", "-c", args.destination],
+            stdin=subprocess.PIPE,
+            cwd=qubes.home(args.dest_vm),
+            env=qubes.vm_environment(args.dest_vm),
+        )
+        output = receiver.stdin
+    else:
+        receiver = None
+        output = open(args.destination, "wb")
+
+    try:
+        with tarfile.open(fileobj=output, mode="w|",
+                          format=tarfile.GNU_FORMAT) as archive:
+            add_member(archive, "backup-header", (
+                "version=4\nencrypted=True\n"
+                f"compressed={command is not None}\n"
+                f"compression-filter={command[0] if command else ''}\n"
+            ).encode())
+            add_member(archive, "qubes.xml.000", (
+                "<domains>"
+                + "".join(f"<domain name='{vm}'/>" for vm in vms)
+                + "</domains>\n"
+            ).encode())
+
+            for index, vm in enumerate(vms):
+                chunks = synthetic(known[vm]["disk"], compressibility)
+                for number, chunk in enumerate(paced(chunks, rate)):
+                    if command:
+                        chunk = subprocess.run(
+                            command,
+                            input=chunk,
+                            stdout=subprocess.PIPE,
+                            check=True,
+                        ).stdout
+                    add_member(
+                        archive,
+                        f"vm{index}/private.img.{number:03}",
+                        chunk,
+                    )
+        output.close()
+    except BrokenPipeError:
+        return fail("backup destination went away")
+    finally:
+        if receiver is not None:
+            receiver.stdin.close()
+            receiver.wait()
+
+    if receiver is not None and receiver.returncode != 0:
+        return fail(f"backup destination exited with {receiver.returncode}")
+
+    if not args.quiet:
+        print("Backup finished", file=sys.stderr)
+    return 0
+
+
+def qvm_run(argv: List[str]) -> int:
+    """
+    Run a command, or a service of FAKEQUBES_SERVICES (default src/),
+    in the qube. Its block device is a link at vms/NAME/dev/xvdi, so
+    `/dev/xvdi` in commands is replaced with it.
+    """
+    parser = argparse.ArgumentParser(prog="qvm-run")
+    parser.add_argument("--quiet", "-q", action="store_true")
+    parser.add_argument("--no-gui", action="store_true")
+    parser.add_argument("--pass-io", "-p", action="store_true")
+    parser.add_argument("--no-autostart", action="store_true")
+    parser.add_argument("--service", action="store_true")
+    parser.add_argument("--user", "-u")
+    parser.add_argument("vm")
+    parser.add_argument("command")
+    args = parser.parse_args(argv)
+
+    qubes = fake()
+    if args.no_autostart and not qubes.running(args.vm):
+        return fail(f"domain '{args.vm}' is not running")
+    if not start(qubes, args.vm):
+        return fail(f"no such domain: '{args.vm}'")
+
+    if args.service:
+        services = Path(os.environ.get("FAKEQUBES_SERVICES", SRC_DIR))
+        service = services / args.command
+        if not service.exists():
+            return fail(f"service {args.command} not found")
+        command = ["bash", str(service)]
+    else:
+        xvdi = str(qubes.xvdi(args.vm))
+        command = ["sh", "-c", args.command
+                   .replace("test -b", "test -e")
+                   .replace("/dev/xvdi", xvdi)]
+
+    return subprocess.run(
+        command,
+        cwd=qubes.home(args.vm),
+        env=qubes.vm_environment(args.vm),
+        stdin=None if args.pass_io else subprocess.DEVNULL,
+    ).returncode
+
+
+def qvm_block(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="qvm-block")
+    commands = parser.add_subparsers(dest="action", required=True)
+    commands.add_parser("list", aliases=["ls"])
+    for action in ("attach", "detach"):
+        command = commands.add_parser(action, aliases=[action[0]])
+        command.add_argument("vm")
+        command.add_argument("device")
+    args = parser.parse_args(argv)
+
+    qubes = fake()
+    if args.action in ("list", "ls"):
+        state = qubes.load()
+        print("BACKEND:DEVID  DESCRIPTION  USED BY")
+        for loop, path in sorted(state["loops"].items()):
+            device = f"dom0:{loop}"
+            used_by = state["attached"].get(device)
+            line = f"{device}  {path}"
+            if used_by:
+                line += f"  {used_by} (frontend-dev=xvdi, read-only=False)"
+            print(line)
+        return 0
+
+    backend, _, loop = args.device.partition(":")
+    xvdi = qubes.xvdi(args.vm)
+    with qubes.state() as state:
+        if backend != "dom0" or loop not in state["loops"]:
+            return fail(f"no such device: {args.device}")
+
+        if args.action in ("attach", "a"):
+            if not state["qubes"].get(args.vm, {}).get("running"):
+                return fail(f"domain '{args.vm}' is not running")
+            if args.device in state["attached"]:
+                return fail(f"device {args.device} already attached")
+            state["attached"][args.device] = args.vm
+            xvdi.parent.mkdir(parents=True, exist_ok=True)
+            xvdi.unlink(missing_ok=True)
+            xvdi.symlink_to(state["loops"][loop])
+        elif state["attached"].get(args.device) == args.vm:
+            del state["attached"][args.device]
+            xvdi.unlink(missing_ok=True)
+    return 0
+
+
+def qvm_start(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="qvm-start")
+    parser.add_argument("--quiet", "-q", action="store_true")
+    parser.add_argument("--skip-if-running", action="store_true")
+    parser.add_argument("vms", nargs="+")
+    args = parser.parse_args(argv)
+
+    qubes = fake()
+    for vm in args.vms:
+        if qubes.running(vm) and not args.skip_if_running:
+            return fail(f"domain '{vm}' is already running")
+        if not start(qubes, vm):
+            return fail(f"no such domain: '{vm}'")
+    return 0
+
+
+def qvm_shutdown(argv: List[str]) -> int:
+    """Halt the qubes, detaching their block devices"""
+    parser = argparse.ArgumentParser(prog="qvm-shutdown")
+    parser.add_argument("--quiet", "-q", action="store_true")
+    parser.add_argument("--wait", action="store_true")
+    parser.add_argument("vms", nargs="+")
+    args = parser.parse_args(argv)
+
+    qubes = fake()
+    with qubes.state() as state:
+        for vm in args.vms:
+            if vm not in state["qubes"]:
+                return fail(f"no such domain: '{vm}'")
+            state["qubes"][vm]["running"] = False
+            for device, used_by in list(state["attached"].items()):
+                if used_by == vm:
+                    del state["attached"][device]
+            qubes.xvdi(vm).unlink(missing_ok=True)
+    return 0
+
+
+def qvm_check(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="qvm-check")
+    parser.add_argument("--quiet", "-q", action="store_true")
+    parser.add_argument("--running", action="store_true")
+    parser.add_argument("vms", nargs="+")
+    args = parser.parse_args(argv)
+
+    qubes = fake()
+    known = qubes.load()["qubes"]
+    for vm in args.vms:
+        if vm not in known:
+            return 2
+        if args.running and not known[vm]["running"]:
+            return 1
+    return 0
+
+
+def qvm_ls(argv: List[str]) -> int:
+    """Only the machine readable output: `--raw-data --fields ...`"""
+    parser = argparse.ArgumentParser(prog="qvm-ls")
+    parser.add_argument("--raw-data", action="store_true")
+    parser.add_argument("--fields", default="NAME,STATE,CLASS")
+    parser.add_argument("vms", nargs="*")
+    args = parser.parse_args(argv)
+
+    qubes = fake().load()["qubes"]
+    fields = args.fields.upper().split(",")
+    for name in sorted(args.vms or qubes):
+        qube = qubes.get(name)
+        if qube is None:
+            return fail(f"no such domain: '{name}'")
+        values = {
+            "NAME": name,
+            "CLASS": qube["class"],
+            "STATE": "Running" if qube["running"] else "Halted",
+            "DISK": f"{qube['disk'] / 1024 / 1024:g}",
+        }
+        print("|".join(values.get(field, "-") for field in fields))
+    return 0
+
+
+def notify_send(argv: List[str]) -> int:
+    fake().log("notifications.log", " ".join(argv))
+    return 0
+
+
+def logger(argv: List[str]) -> int:
+    qubes = fake()
+    for line in sys.stdin:
+        qubes.log("syslog", line)
+    return 0
+
+
+def losetup(argv: List[str]) -> int:
+    """`losetup --show -f FILE` and `losetup -d DEVICE`"""
+    parser = argparse.ArgumentParser(prog="losetup")
+    parser.add_argument("--show", action="store_true")
+    parser.add_argument("-f", "--find", action="store_true")
+    parser.add_argument("-d", "--detach")
+    parser.add_argument("file", nargs="?")
+    args = parser.parse_args(argv)
+
+    qubes = fake()
+    sys_block = qubes.root / "sys" / "block"
+    with qubes.state() as state:
+        if args.detach:
+            loop = Path(args.detach).name
+            if state["loops"].pop(loop, None) is None:
+                return fail(f"{args.detach}: no such device")
+            (sys_block / loop / "size").unlink(missing_ok=True)
+            return 0
+
+        path = Path(args.file).resolve()
+        number = 0
+        while f"loop{number}" in state["loops"]:
+            number += 1
+        loop = f"loop{number}"
+        state["loops"][loop] = str(path)
+
+    (sys_block / loop).mkdir(parents=True, exist_ok=True)
+    sectors = -(-path.stat().st_size // SECTOR_SIZE)
+    (sys_block / loop / "size").write_text(f"{sectors}\n")
+    if args.show:
+        print(f"/dev/{loop}")
+    return 0
+
+
+def sudo(argv: List[str]) -> int:
+    os.execvp(argv[0], argv)
+
+
+def ssh(argv: List[str]) -> int:
+    """
+    `ssh [OPTIONS] HOST [--] COMMAND`: run qbackup-shell, or
+    FAKEQUBES_SHELL, as the login shell of the backup user of HOST
+    """
+    while argv and argv[0].startswith("-") and argv[0] != "--":
+        option = argv.pop(0)
+        if option in ("-o", "-p", "-i", "-l", "-F") and argv:
+            argv.pop(0)
+    host = argv.pop(0)
+    if argv and argv[0] == "--":
+        argv.pop(0)
+
+    home = fake().server(host)
+    home.mkdir(parents=True, exist_ok=True)
+    # the catalog and locks of qbackup-shell, out of the home
+    state = home.parent / f"{host}.state"
+    state.mkdir(exist_ok=True)
+    shell = os.environ.get("FAKEQUBES_SHELL", str(SRC_DIR / "qbackup-shell"))
+    return subprocess.run(
+        [sys.executable, shell, "-c", " ".join(argv)],
+        cwd=home,
+        env={
+            **os.environ,
+            "HOME": str(home),
+            "QBKP_STATE_DIR": str(state),
+            "SSH_CONNECTION": "127.0.0.1 0 127.0.0.1 22",
+        },
+    ).returncode
+
+
+COMMANDS = {
+    "qvm-backup": qvm_backup,
+    "qvm-run": qvm_run,
+    "qvm-block": qvm_block,
+    "qvm-start": qvm_start,
+    "qvm-shutdown": qvm_shutdown,
+    "qvm-check": qvm_check,
+    "qvm-ls": qvm_ls,
+    "notify-send": notify_send,
+    "logger": logger,
+    "losetup": losetup,
+    "sudo": sudo,
+    "ssh": ssh,
+}
+
+
+if __name__ == "__main__":
+    sys.exit(COMMANDS[sys.argv[1]](sys.argv[2:]))
@@ -0,0 +1,275 @@
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+import re
+import subprocess
+import sys
+import tarfile
+import time
+
+import pytest
+from tests.fakequbes import FakeQubes, add_member
+
+CARRIER = Path(__file__).parent.parent / "src" / "qbackup-carrier"
+MiB = 1024 * 1024
+NAME = "work-2026-01-01T10-00.backup"
+
+
+@pytest.fixture
+def servers(tmp_path, monkeypatch):
+    """Fake ssh servers, running src/qbackup-shell"""
+    qubes = FakeQubes(tmp_path / "qubes")
+    for name, value in qubes.install().items():
+        monkeypatch.setenv(name, value)
+    return qubes
+
+
+@pytest.fixture
+def disk(tmp_path):
+    """Backup disk of random data, not aligned on reads"""
+    path = tmp_path / "disk"
+    path.write_bytes(os.urandom(10 * MiB + 1000))
+    return path
+
+
+def ssh(host, command, data=b""):
+    """Run `command` in the shell of the backup user of `host`"""
+    return subprocess.run(
+        ["ssh", host, "--", command],
+        input=data,
+        capture_output=True,
+    )
+
+
+def carrier(*args, data=b"", **environment):
+    env = {
+        key: value for key, value in os.environ.items()
+        if not key.startswith(("SSH_", "QBKP_"))
+    }
+    env.update(environment)
+
+    return subprocess.run(
+        [sys.executable, str(CARRIER), *args],
+        input=data,
+        capture_output=True,
+        env=env,
+    )
+
+
+@pytest.mark.parametrize("disk", ["-", "/dev/null"])
+def test_carrier_needs_a_server(disk):
+    result = carrier("--disk", disk, "work.backup", data=b"abc")
+
+    assert result.returncode == 2
+    assert b"no backup server" in result.stderr
+
+
+@pytest.mark.parametrize("quorum", ["0", "3"])
+def test_carrier_refuses_quorum_out_of_range(quorum):
+    result = carrier(
+        "--disk", "-", "--quorum", quorum, "work.backup",
+        data=b"abc",
+        SSH_CONN="server1 server2",
+    )
+
+    assert result.returncode == 2
+    assert b"quorum must be between 1 and 2" in result.stderr
+
+
+
+def test_carrier_resumes_a_partial_upload(servers, disk):
+    data = disk.read_bytes()
+    half = len(data) // 2
+    ssh("server1", f"--size {len(data)} -- {NAME}", data[:half])
+
+    result = carrier("--disk", str(disk), NAME, SSH_CONN="server1")
+
+    assert result.returncode == 0, result.stderr
+    assert f"to server1 from offset {half}".encode() in result.stderr
+    assert (servers.server("server1") / NAME).read_bytes() == data
+
+
+def test_carrier_fails_on_checksum_mismatch(
+    servers, disk, tmp_path, monkeypatch
+):
+    uploads = tmp_path / "uploads"
+    shell = tmp_path / "corrupting-shell"
+    shell.write_text(
+        "import sys\n"
+        "command = sys.argv[2]\n"
+        "if '--status' in command:\n"
+        "    print(0)\n"
+        "else:\n"
+        "    sys.stdin.buffer.read()\n"
+        f"    with open({str(uploads)!r}, 'a') as fp:\n"
+        "        fp.write(command + '\\n')\n"
+        "    print('blake2b', '0' * 128)\n"
+    )
+    monkeypatch.setenv("FAKEQUBES_SHELL", str(shell))
+
+    result = carrier("--disk", str(disk), NAME,
+                     SSH_CONN="server1", SSH_RETRIES="3")
+
+    assert result.returncode == 3
+    assert b"Checksum mismatch" in result.stderr
+    # a server storing corrupt data is not fixed by resuming
+    assert len(uploads.read_text().splitlines()) == 1
+
+
+@pytest.mark.parametrize("args", [
+    ["--rate", "8M"],
+    # wrapping around midnight, so one of them is always in effect
+    ["--rate", "16M", "--schedule", "00:00-12:00=50%,12:00-00:00=50%"],
+])
+def test_carrier_shapes_the_transfer_rate(servers, disk, args):
+    started = time.monotonic()
+    result = carrier("--disk", str(disk), "--burst", "1M", *args, NAME,
+                     SSH_CONN="server1")
+
+    assert result.returncode == 0, result.stderr
+    # all but the burst is sent at the rate
+    assert time.monotonic() - started >= 9 / 8
+    assert b"target rate was 8.4 MB/s" in result.stderr
+
+
+@pytest.mark.parametrize("schedule, error", [
+    ("08:00-18:00=fast", b"invalid parse_schedule value"),
+    ("8h-18h=1M", b"invalid parse_schedule value"),
+    ("08:00-18:00=20%", b"relative schedule rates need --rate"),
+])
+def test_carrier_refuses_invalid_schedules(schedule, error):
+    result = carrier("--disk", "-", "--schedule", schedule, NAME,
+                     SSH_CONN="server1")
+
+    assert result.returncode == 2
+    assert error in result.stderr
+
+
+def test_carrier_sends_only_data_in_sparse_mode(servers, tmp_path):
+    disk = tmp_path / "sparse-disk"
+    with open(disk, "wb") as fp:
+        fp.truncate(16 * MiB)
+        fp.seek(4 * MiB)
+        fp.write(os.urandom(MiB))
+        # allocated, but only zeros
+        fp.write(bytes(MiB))
+        fp.seek(16 * MiB - 1000)
+        fp.write(os.urandom(1000))
+    data = disk.read_bytes()
+
+    result = carrier("--disk", str(disk), "--sparse", NAME,
+                     SSH_CONN="server1")
+
+    assert result.returncode == 0, result.stderr
+    # data extents are as large as filesystem blocks
+    sent = int(re.search(rb"sent (\d+) bytes", result.stderr)[1])
+    assert MiB + 1000 <= sent <= MiB + 64 * 1024
+    stored = servers.server("server1") / NAME
+    assert stored.read_bytes() == data
+    assert stored.stat().st_blocks * 512 < 4 * MiB
+    manifest = json.loads(stored.with_name(NAME + ".manifest").read_text())
+    assert manifest["digest"] == hashlib.blake2b(data).hexdigest()
+
+
+def test_carrier_restores_over_concurrent_ranges(servers, disk):
+    carrier("--disk", str(disk), NAME, SSH_CONN="server1 server2")
+
+    result = carrier("--restore", "--sessions", "3", "--range-size", "1",
+                     NAME, SSH_CONN="server1 server2")
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == disk.read_bytes()
+
+
+def test_carrier_restore_fails_on_corrupt_backup(servers, disk):
+    carrier("--disk", str(disk), NAME, SSH_CONN="server1")
+    stored = servers.server("server1") / NAME
+    with open(stored, "r+b") as fp:
+        fp.seek(5 * MiB)
+        fp.write(b"corrupt")
+
+    result = carrier("--restore", NAME, SSH_CONN="server1")
+
+    assert result.returncode == 4
+    assert b"Checksum mismatch" in result.stderr
+
+
+# long enough to need an extension header in both formats
+LONG_NAME = "vm1/" + "x" * 120 + "/private.img.000"
+
+
+@pytest.mark.parametrize("format", [tarfile.GNU_FORMAT, tarfile.PAX_FORMAT])
+def test_carrier_restores_archive_members(servers, tmp_path, format):
+    contents = {
+        "backup-header": b"version=4\n",
+        "qubes.xml.000": b"<domains/>\n",
+        "vm0/private.img.000": os.urandom(300 * 1024),
+        LONG_NAME: os.urandom(1000),
+        "vm2/private.img.000": os.urandom(2000),
+    }
+    disk = tmp_path / "archive"
+    with tarfile.open(disk, "w", format=format) as archive:
+        for name, data in contents.items():
+            add_member(archive, name, data)
+    carrier("--disk", str(disk), NAME, SSH_CONN="server1")
+
+    listed = carrier("--list", NAME, SSH_CONN="server1")
+    restored = carrier("--restore", "--member", "vm1/", NAME,
+                       SSH_CONN="server1")
+
+    assert listed.stdout.decode().splitlines() == [
+        f"{len(data)}\t{name}" for name, data in contents.items()
+    ]
+    assert restored.returncode == 0, restored.stderr
+    with tarfile.open(fileobj=io.BytesIO(restored.stdout)) as archive:
+        assert {
+            member.name: archive.extractfile(member).read()
+            for member in archive
+        } == {
+            name: contents[name]
+            for name in ("backup-header", "qubes.xml.000", LONG_NAME)
+        }
+
+
+def test_carrier_sends_ranges_over_concurrent_sessions(servers, disk):
+    data = disk.read_bytes()
+
+    result = carrier("--disk", str(disk), "--streams", "3", NAME,
+                     SSH_CONN="server1 server2")
+
+    assert result.returncode == 0, result.stderr
+    for host in ("server1", "server2"):
+        home = servers.server(host)
+        assert sorted(path.name for path in home.iterdir()) == [
+            NAME, NAME + ".manifest",
+        ]
+        assert (home / NAME).read_bytes() == data
+        manifest = json.loads((home / (NAME + ".manifest")).read_text())
+        assert [
+            (state["start"], state["length"]) for state in manifest["ranges"]
+        ] == [(0, 4 * MiB), (4 * MiB, 4 * MiB), (8 * MiB, 2 * MiB + 1000)]
+
+    # verified range by range against the manifest
+    restored = carrier("--restore", NAME, SSH_CONN="server2")
+    assert restored.stdout == data
+
+
+@pytest.mark.parametrize("args", [
+    ["--read-size", "1"],
+    ["--read-size", "3", "--direct"],
+    ["--direct", "--streams", "2"],
+    ["--direct", "--sparse"],
+])
+def test_carrier_reads_the_disk_intact(servers, disk, args):
+    result = carrier("--disk", str(disk), *args, NAME, SSH_CONN="server1")
+
+    assert result.returncode == 0, result.stderr
+    assert (servers.server("server1") / NAME).read_bytes() == disk.read_bytes()
+    if "--direct" in args:
+        # e.g. tmpfs has no direct reads, the carrier falls back
+        assert (
+            b", direct)" in result.stderr
+            or b"does not support direct reads" in result.stderr
+        )
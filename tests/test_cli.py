@@ -1,9 +1,19 @@
 from collections import namedtuple
+from datetime import datetime
+import json
+import sqlite3
+import subprocess
 from pytest import fixture
 import pytest
-from qbackup.api import ModelNotFound
-from qbackup.cli import QbackupCLIManager
+from qbackup.api import ModelNotFound, YamlStream
+from qbackup.cli import CommandLineInterface, QbackupCLIManager
 from qbackup.database import StreamDataManager
+from qbackup.models import Period, Qube, Run
+
+
+def quiet_run(args, **kwargs):
+    """`subprocess.run` of commands not run by the tests"""
+    return subprocess.CompletedProcess(args, 0, stdout="")
 
 
 @fixture
@@ -312,3 +322,692 @@ def test_delete_qubes_from_group_will_fail_when_qube_not_associated(cli_manager)
 
     with pytest.raises(ModelNotFound):
         cli_manager.delete_qubes_from_group()
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [
+        {
+            # Add the period before creating the group
+            "periods": (["monthly"],),
+
+            "group": "foo group",
+            "period": "monthly",
+            "compression": "zstdmt",
+            "splittable": None,
+        }
+    ],
+    indirect=True,
+)
+def test_set_group_changes_compression(cli_manager):
+    cli_manager.add_periods()
+    cli_manager.add_group()
+    assert cli_manager.groups.get("foo group").compression == "zstdmt"
+
+    cli_manager.args = cli_manager.args._replace(compression="none")
+    cli_manager.set_group()
+
+    assert cli_manager.groups.get("foo group").compression == "none"
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [
+        {
+            "periods": (["daily"],),
+            "schedule": "0 2 * * *",
+        }
+    ],
+    indirect=True,
+)
+def test_schedule_periods_catches_up_missed_runs(cli_manager):
+    cli_manager.add_periods()
+
+    now = datetime(2021, 11, 11, 12, 0)
+    assert cli_manager.schedule_periods(now) == [
+        (datetime(2021, 11, 12, 2, 0), "daily"),
+    ]
+
+    # dom0 was off for two days: the missed run is due right away
+    period = cli_manager.periods.get("daily")
+    period.last_run = "2021-11-09T02:00:00"
+    cli_manager.periods.upsert(period)
+
+    next_run, period_name = cli_manager.schedule_periods(now)[0]
+    assert next_run <= now
+    assert period_name == "daily"
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [
+        {
+            "periods": (["daily"],),
+            "schedule": "0 2 * *",
+        }
+    ],
+    indirect=True,
+)
+def test_add_periods_refuses_invalid_schedule(cli_manager):
+    with pytest.raises(ValueError):
+        cli_manager.add_periods()
+
+
+class StopDaemon(Exception):
+    pass
+
+
+def test_daemon_sees_periods_saved_by_other_calls(
+    dummy_connector,
+    monkeypatch,
+    tmp_path,
+):
+    stream = YamlStream(tmp_path / "db")
+
+    def data_manager_factory(*args, **kwargs):
+        return StreamDataManager(stream, *args, **kwargs)
+
+    daemon = QbackupCLIManager(data_manager_factory)
+    daemon.initialize(dummy_connector, None)
+
+    # e.g. `qbackup period add` while the daemon runs
+    other = QbackupCLIManager(data_manager_factory)
+    other.initialize(dummy_connector, None)
+    other.periods.upsert(Period(
+        name="daily",
+        schedule="0 2 * * *",
+        last_run="2021-11-09T02:00:00",
+    ))
+    other.periods.save()
+
+    started = []
+
+    def run_scheduled_period(period_name):
+        started.append(period_name)
+        raise StopDaemon()
+
+    monkeypatch.setattr(daemon, "run_scheduled_period", run_scheduled_period)
+    with pytest.raises(StopDaemon):
+        daemon.run_daemon()
+
+    assert started == ["daily"]
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [{"periods": (["daily"],), "schedule": None}],
+    indirect=True,
+)
+@pytest.mark.parametrize("error", [
+    ValueError("Invalid compression filter: pigz -p 4; rm -rf ~"),
+    RuntimeError("cannot schedule new futures after shutdown"),
+    sqlite3.OperationalError("database is locked"),
+])
+def test_scheduled_period_failure_keeps_daemon_running(
+    cli_manager,
+    monkeypatch,
+    capsys,
+    error,
+):
+    cli_manager.add_periods()
+
+    def run_backup(period):
+        raise error
+
+    monkeypatch.setattr(cli_manager, "run_backup", run_backup)
+    cli_manager.run_scheduled_period("daily")
+
+    assert "scheduled period failed: daily" in capsys.readouterr().out
+    assert cli_manager.periods.get("daily").last_run is not None
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [{"periods": (["daily"],), "schedule": None}],
+    indirect=True,
+)
+def test_schedule_periods_skips_invalid_schedules(cli_manager):
+    cli_manager.add_periods()
+    cli_manager.periods.upsert(Period(name="broken", schedule="not a cron"))
+
+    assert cli_manager.schedule_periods(datetime(2021, 11, 11)) == []
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [
+        {
+            "periods": (["daily"],),
+            "period": "daily",
+            "group": "work",
+            "jobs": 2,
+        }
+    ],
+    indirect=True,
+)
+def test_run_backup_jobs_of_an_empty_period(cli_manager, monkeypatch, capsys):
+    cli_manager.add_periods()
+    cli_manager.add_group()
+
+    def qube_sizes():
+        raise FileNotFoundError("qvm-ls")
+
+    monkeypatch.setattr("qbackup.inventory.qube_sizes", qube_sizes)
+    monkeypatch.setattr("subprocess.run", quiet_run)
+    monkeypatch.setattr(cli_manager, "backup_qubes", None)
+
+    cli_manager.run_backup()
+
+    assert "no qubes to back up in period: daily" in capsys.readouterr().err
+    assert cli_manager.runs.list() == []
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [
+        {
+            "periods": (["daily"],),
+            "period": "daily",
+            "group": "work",
+            "qubes": [["big", "small"]],
+            "splittable": True,
+            "jobs": 2,
+        }
+    ],
+    indirect=True,
+)
+def test_run_backup_packs_splittable_groups_into_jobs(cli_manager, monkeypatch):
+    cli_manager.add_periods()
+    cli_manager.add_group()
+    cli_manager.associate_qubes_to_group()
+
+    monkeypatch.setattr(
+        "qbackup.inventory.qube_sizes",
+        lambda: {"big": 400, "small": 10},
+    )
+    backups = []
+    monkeypatch.setattr(
+        cli_manager,
+        "backup_qubes",
+        lambda name, qubes, compression_filter, input_bytes:
+            backups.append((name, qubes)) or Run(
+                name=name,
+                started="now",
+                seconds=10,
+                input_bytes=input_bytes,
+                output_bytes=input_bytes // 2,
+            ),
+    )
+    monkeypatch.setattr("subprocess.run", quiet_run)
+
+    cli_manager.run_backup()
+
+    assert sorted(backups) == [
+        ("daily-job0", ["big"]),
+        ("daily-job1", ["small"]),
+    ]
+    # recorded by group, for the estimates of later runs
+    assert sorted(
+        (run.name, run.input_bytes, run.output_bytes)
+        for run in cli_manager.runs.list()
+    ) == [
+        ("work", 10, 5),
+        ("work", 400, 200),
+    ]
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [
+        {
+            "periods": (["daily"],),
+            "period": "daily",
+            "group": "work",
+            "qubes": [["big", "small"]],
+            "nice": 19,
+            "ionice": "idle",
+            "idle_seconds": 120,
+        }
+    ],
+    indirect=True,
+)
+def test_run_backup_records_throttled_time(cli_manager, monkeypatch):
+    cli_manager.add_periods()
+    cli_manager.add_group()
+    cli_manager.associate_qubes_to_group()
+
+    monkeypatch.setattr(
+        "qbackup.inventory.qube_sizes",
+        lambda: {"big": 400, "small": 10},
+    )
+    monkeypatch.setattr("subprocess.run", quiet_run)
+    commands = []
+    monkeypatch.setattr(
+        "qbackup.governor.Governor.run",
+        lambda self, args, input=None:
+            commands.append(self.priority.command(args)) or 12.5,
+    )
+
+    cli_manager.run_backup()
+
+    command, = commands
+    assert command[:6] == ["ionice", "-c", "3", "nice", "-n", "19"]
+    assert command[6] == "qvm-backup"
+    run, = cli_manager.runs.list()
+    assert run.throttled_seconds == 12.5
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [
+        {
+            "periods": (["daily"],),
+            "period": "daily",
+            "group": "work",
+            "qubes": [["mail", "notes"]],
+        }
+    ],
+    indirect=True,
+)
+def test_run_backup_resolves_group_members_at_once(cli_manager, monkeypatch):
+    cli_manager.add_periods()
+    cli_manager.add_group()
+    cli_manager.associate_qubes_to_group()
+    cli_manager.args = cli_manager.args._replace(
+        group="home",
+        qubes=[["media"]],
+    )
+    cli_manager.add_group()
+    cli_manager.associate_qubes_to_group()
+
+    monkeypatch.setattr(
+        "qbackup.inventory.qube_sizes",
+        lambda: {"mail": 10, "notes": 20, "media": 30},
+    )
+    monkeypatch.setattr("subprocess.run", quiet_run)
+    backups = []
+    monkeypatch.setattr(
+        cli_manager,
+        "backup_qubes",
+        lambda name, qubes, compression_filter, input_bytes:
+            backups.append((name, qubes, input_bytes))
+            or Run(name=name, started="now"),
+    )
+    # every group member comes from the period lookup
+    monkeypatch.setattr(cli_manager.qubes, "find_all", None)
+
+    cli_manager.run_backup()
+
+    assert sorted(backups) == [
+        ("home", ["media"], 30),
+        ("work", ["mail", "notes"], 30),
+    ]
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [
+        {
+            "periods": (["daily"],),
+            "period": "daily",
+            "group": "work",
+            "qubes": [["big", "small"]],
+            "metrics_dir": None,
+        }
+    ],
+    indirect=True,
+)
+def test_run_backup_exports_stage_metrics(cli_manager, monkeypatch, tmp_path):
+    cli_manager.add_periods()
+    cli_manager.add_group()
+    cli_manager.associate_qubes_to_group()
+    cli_manager.args = cli_manager.args._replace(metrics_dir=str(tmp_path))
+
+    monkeypatch.setattr(
+        "qbackup.inventory.qube_sizes",
+        lambda: {"big": 400, "small": 10},
+    )
+    monkeypatch.setattr("subprocess.run", quiet_run)
+
+    cli_manager.run_backup()
+
+    text = (tmp_path / "qbackup-daily.prom").read_text()
+    assert (
+        'qbackup_stage_bytes{run="daily",stage="group",group="work"} 410'
+    ) in text
+    assert 'stage="qvm-backup",backup="work"' in text
+
+    trace = json.loads((tmp_path / "qbackup-daily.trace.json").read_text())
+    assert [event["name"] for event in trace["traceEvents"]] == [
+        "run",
+        "inventory",
+        "group",
+        "qvm-backup",
+    ]
+    assert cli_manager.metrics.spans == []
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [
+        {
+            "periods": (["daily"],),
+            "period": "daily",
+            "group": "work",
+            "qubes": [["big", "small"]],
+            "plan": True,
+        }
+    ],
+    indirect=True,
+)
+def test_run_backup_plan_only_prints_estimates(
+    cli_manager, monkeypatch, capsys
+):
+    cli_manager.add_periods()
+    cli_manager.add_group()
+    cli_manager.associate_qubes_to_group()
+    cli_manager.runs.upsert(
+        Run(name="work", started="now", seconds=10, input_bytes=1000)
+    )
+
+    monkeypatch.setattr(
+        "qbackup.inventory.qube_sizes",
+        lambda: {"big": 3000, "small": 600},
+    )
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the plan must not start a backup")
+
+    monkeypatch.setattr("subprocess.run", fail)
+
+    cli_manager.run_backup()
+
+    out = capsys.readouterr().out
+    assert "work" in out
+    assert "0:00:36" in out
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [
+        {
+            "periods": (["daily"],),
+            "period": "daily",
+            "group": "work",
+            "plan": True,
+            "jobs": 2,
+        }
+    ],
+    indirect=True,
+)
+def test_run_backup_plan_of_an_empty_period(cli_manager, monkeypatch, capsys):
+    cli_manager.add_periods()
+    cli_manager.add_group()
+    monkeypatch.setattr("qbackup.inventory.qube_sizes", lambda: {})
+
+    cli_manager.run_backup()
+
+    captured = capsys.readouterr()
+    assert "no qubes to back up in period: daily" in captured.err
+    assert captured.out == ""
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [
+        {
+            "periods": (["daily"],),
+            "period": "daily",
+            "group": "work",
+            "qubes": [["big", "small"]],
+            "plan": True,
+        }
+    ],
+    indirect=True,
+)
+def test_run_backup_plan_without_inventory(cli_manager, monkeypatch, capsys):
+    cli_manager.add_periods()
+    cli_manager.add_group()
+    cli_manager.associate_qubes_to_group()
+
+    def qube_sizes():
+        raise FileNotFoundError("qvm-ls")
+
+    monkeypatch.setattr("qbackup.inventory.qube_sizes", qube_sizes)
+
+    cli_manager.run_backup()
+
+    captured = capsys.readouterr()
+    assert "cannot list qubes" in captured.err
+    assert "unknown qubes: big, small" in captured.out
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [
+        {
+            "periods": (["daily"],),
+            "period": "daily",
+            "group": "work",
+            "qubes": [["big", "small"]],
+        }
+    ],
+    indirect=True,
+)
+def test_run_backup_fails_on_unknown_qubes_before_starting(
+    cli_manager, monkeypatch
+):
+    cli_manager.add_periods()
+    cli_manager.add_group()
+    cli_manager.associate_qubes_to_group()
+
+    monkeypatch.setattr("qbackup.inventory.qube_sizes", lambda: {"big": 400})
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the run must not start")
+
+    monkeypatch.setattr("subprocess.run", fail)
+
+    with pytest.raises(ModelNotFound, match="small"):
+        cli_manager.run_backup()
+    assert cli_manager.runs.list() == []
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [
+        {
+            "periods": (["daily"],),
+            "group": "work",
+            "period": "daily",
+            "qubes": [["big", "bgi", "smal"]],
+        }
+    ],
+    indirect=True,
+)
+def test_associate_qubes_rejects_unknown_qubes(cli_manager, monkeypatch):
+    cli_manager.add_periods()
+    cli_manager.add_group()
+    monkeypatch.setattr(
+        "qbackup.inventory.qube_sizes",
+        lambda: {"big": 400, "small": 10},
+    )
+
+    with pytest.raises(ModelNotFound, match="Unknown qubes: bgi, smal"):
+        cli_manager.associate_qubes_to_group()
+    assert cli_manager.qubes.list() == []
+
+
+IMPORT_JSONL = """\
+{"model": "periods", "data": {"name": "daily"}}
+{"model": "groups", "data": {"name": "work", "period": "daily"}}
+{"model": "qubes", "data": {"id": "q1", "name": "vault", "group_name": "work"}}
+{"model": "qubes", "data": {"id": "q2", "name": "mail", "group_name": "work"}}
+"""
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [
+        {
+            "periods": (["daily"],),
+            "group": "work",
+            "period": "daily",
+            "qubes": [["vault"]],
+            "file": None,
+            "format": None,
+            "mode": "merge",
+        }
+    ],
+    indirect=True,
+)
+def test_import_merges_with_current_config(cli_manager, tmp_path):
+    cli_manager.add_periods()
+    cli_manager.add_group()
+    cli_manager.associate_qubes_to_group()
+    vault_id = cli_manager.qubes.slow_find_one(name="vault").id
+
+    path = tmp_path / "config.jsonl"
+    path.write_text(IMPORT_JSONL)
+    cli_manager.args = cli_manager.args._replace(file=str(path))
+    cli_manager.import_config()
+
+    qubes = {qube.name: qube.id for qube in cli_manager.qubes.list()}
+    assert qubes == {"vault": vault_id, "mail": "q2"}
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [
+        {
+            "periods": (["weekly"],),
+            "group": "old",
+            "period": "weekly",
+            "file": None,
+            "format": None,
+            "mode": "replace",
+        }
+    ],
+    indirect=True,
+)
+def test_import_replaces_current_config(cli_manager, tmp_path):
+    cli_manager.add_periods()
+    cli_manager.add_group()
+
+    path = tmp_path / "config.jsonl"
+    path.write_text(IMPORT_JSONL)
+    cli_manager.args = cli_manager.args._replace(file=str(path))
+    cli_manager.import_config()
+
+    assert [period.name for period in cli_manager.periods.list()] == ["daily"]
+    assert [group.name for group in cli_manager.groups.list()] == ["work"]
+    assert len(cli_manager.qubes.list()) == 2
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [{"file": None, "format": "jsonl", "mode": "merge"}],
+    indirect=True,
+)
+def test_import_refuses_unknown_references(cli_manager, tmp_path):
+    path = tmp_path / "config"
+    path.write_text(
+        '{"model": "groups", "data": {"name": "work", "period": "daily"}}\n'
+    )
+    cli_manager.args = cli_manager.args._replace(file=str(path))
+
+    with pytest.raises(ModelNotFound):
+        cli_manager.import_config()
+
+    assert cli_manager.groups.list() == []
+
+
+@pytest.mark.parametrize("record", [
+    '{"model": "periods", "data": {"name": "daily", "schedule": "not a cron"}}',
+    '{"model": "groups", "data": {"name": "work", "period": "daily", '
+    '"compression": "pigz -p 4; rm -rf ~"}}',
+])
+@pytest.mark.parametrize(
+    "cli_manager",
+    [{"file": None, "format": "jsonl", "mode": "merge"}],
+    indirect=True,
+)
+def test_import_refuses_invalid_values(cli_manager, tmp_path, record):
+    path = tmp_path / "config"
+    path.write_text(
+        '{"model": "periods", "data": {"name": "daily"}}\n' + record + "\n"
+    )
+    cli_manager.args = cli_manager.args._replace(file=str(path))
+
+    with pytest.raises(ValueError, match="Invalid"):
+        cli_manager.import_config()
+
+    assert cli_manager.periods.list() == []
+    assert cli_manager.groups.list() == []
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [
+        {
+            "periods": (["daily"],),
+            "group": "work",
+            "period": "daily",
+            "qubes": [["vault"]],
+            "file": None,
+            "format": None,
+            "mode": "replace",
+        }
+    ],
+    indirect=True,
+)
+def test_export_then_import_roundtrip(cli_manager, tmp_path):
+    cli_manager.add_periods()
+    cli_manager.add_group()
+    cli_manager.associate_qubes_to_group()
+    before = {name: m.list() for name, m in cli_manager.managers.items()}
+
+    path = tmp_path / "config.yaml"
+    cli_manager.args = cli_manager.args._replace(file=str(path))
+    cli_manager.export_config()
+    cli_manager.import_config()
+
+    after = {name: m.list() for name, m in cli_manager.managers.items()}
+    assert after == before
+
+
+@pytest.mark.parametrize(
+    "cli_manager",
+    [
+        {
+            "periods": (["daily"],),
+            "period": "daily",
+            "group": "work",
+            "qubes": [["vault", "mail"]],
+            "format": "jsonl",
+        }
+    ],
+    indirect=True,
+)
+def test_list_qubes_filters_by_group(cli_manager, capsys):
+    cli_manager.add_periods()
+    cli_manager.add_group()
+    cli_manager.associate_qubes_to_group()
+    cli_manager.qubes.upsert(Qube(name="other", group_name="media"))
+
+    cli_manager.list_qubes()
+
+    lines = capsys.readouterr().out.splitlines()
+    assert sorted(json.loads(line)["name"] for line in lines) == [
+        "mail",
+        "vault",
+    ]
+
+
+@pytest.mark.parametrize("command", [["run", "daily"], ["daemon"]])
+def test_throttling_is_opt_in(command):
+    cli = CommandLineInterface()
+    cli.cli_manager = manager = QbackupCLIManager(None)
+    manager.args = cli.get_parser().parse_args(command)
+
+    assert not manager.resource_governor().watching
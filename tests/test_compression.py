@@ -0,0 +1,33 @@
+import pytest
+from qbackup import compression
+
+
+@pytest.mark.parametrize(
+    "filter_name, expected",
+    [
+        (None, ["--compress"]),
+        ("gzip", ["--compress"]),
+        ("none", ["--no-compress"]),
+        ("zstdmt", ["--compress-filter", "zstdmt"]),
+    ],
+)
+def test_backup_args_select_compression_filter(filter_name, expected):
+    assert compression.backup_args(filter_name) == expected
+
+
+def test_backup_args_refuses_filter_with_arguments():
+    with pytest.raises(ValueError):
+        compression.backup_args("zstd -T0")
+
+
+def test_benchmark_measures_ratio_of_filter():
+    sample = b"a" * 1024 * 1024
+    result = compression.benchmark("gzip", sample)
+
+    assert result.input_bytes == len(sample)
+    assert result.ratio < 0.1
+
+
+def test_benchmark_without_compression_keeps_size():
+    result = compression.benchmark("none", b"abc")
+    assert result.ratio == 1
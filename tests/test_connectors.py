@@ -49,3 +49,28 @@ def test_sqlite_connector_automatically_execute_bootstrap_sql(monkeypatch):
     with SqliteConnector("db", sql):
         mock_connection.executescript.assert_called_once_with(sql)
         mock_connection.commit.assert_called_once()
+
+
+def test_sqlite_connector_migrates_existing_database(tmpdir):
+    database = str(tmpdir / "db")
+    migrations = ["ALTER TABLE test ADD COLUMN name VARCHAR;"]
+
+    with SqliteConnector(database, "CREATE TABLE test (id VARCHAR);"):
+        pass
+
+    with SqliteConnector(database, migrations=migrations) as connector:
+        connector._conn.execute("INSERT INTO test (id, name) VALUES (1, 2)")
+        version, = connector._conn.execute("PRAGMA user_version").fetchone()
+
+    assert version == 1
+
+
+def test_sqlite_connector_skips_migrations_when_bootstrapping(tmpdir):
+    database = str(tmpdir / "db")
+    sql = "CREATE TABLE test (id VARCHAR, name VARCHAR);"
+    migrations = ["ALTER TABLE test ADD COLUMN name VARCHAR;"]
+
+    with SqliteConnector(database, sql, migrations) as connector:
+        version, = connector._conn.execute("PRAGMA user_version").fetchone()
+
+    assert version == 1
@@ -10,11 +10,18 @@ from qbackup.database import SqliteDataManager, StreamDataManager
 
 TEST_SQL = """
 DROP TABLE IF EXISTS test;
+DROP TABLE IF EXISTS bars;
 
 CREATE TABLE test (
     id VARCHAR NOT NULL PRIMARY KEY,
     name VARCHAR NOT NULL
 );
+
+CREATE TABLE bars (
+    id VARCHAR NOT NULL PRIMARY KEY,
+    foo_id VARCHAR NOT NULL,
+    name VARCHAR NOT NULL
+);
 """
 
 
@@ -27,6 +34,16 @@ class Foo(AbstractModel):
         return self.id
 
 
+@dataclass
+class Bar(AbstractModel):
+    id: str
+    foo_id: str
+    name: str
+
+    def keyid(self) -> Hashable:
+        return self.id
+
+
 @fixture(params=["sqlite", "stream"])
 def data_manager(request, tmpdir):
     uri = tmpdir / "db"
@@ -55,6 +72,19 @@ def data_manager(request, tmpdir):
     connector.close()
 
 
+@fixture
+def bars_manager(data_manager):
+    """Manager of `Bar` models sharing the storage of `data_manager`"""
+    if isinstance(data_manager, SqliteDataManager):
+        return SqliteDataManager("bars", data_manager._connector, Bar)
+    return StreamDataManager(
+        data_manager._stream,
+        "bars",
+        data_manager._connector,
+        Bar,
+    )
+
+
 def test_database_list_all_items_when_empty(data_manager):
     assert data_manager.list() == []
 
@@ -188,3 +218,110 @@ def test_database_slow_find_one_return_none_when_no_model_matches_condition(data
     )
 
     assert found_model is None
+
+
+def test_database_bulk_upsert_inserts_and_updates(data_manager):
+    data_manager.upsert(Foo(id="key1", name="old"))
+
+    data_manager.bulk_upsert([
+        Foo(id="key1", name="baz"),
+        Foo(id="key2", name="bar"),
+    ])
+
+    assert sorted(data_manager.list(), key=lambda model: model.id) == [
+        Foo(id="key1", name="baz"),
+        Foo(id="key2", name="bar"),
+    ]
+
+
+def test_database_clear_removes_every_model(data_manager):
+    data_manager.bulk_upsert([Foo(id="key1", name="baz")])
+    data_manager.clear()
+
+    assert data_manager.list() == []
+
+
+def test_stream_save_keeps_other_prefixes(tmpdir):
+    connector = FileBackedConnector(tmpdir)
+    stream = YamlStream(tmpdir / "db")
+    foos = StreamDataManager(stream, "foos", connector, Foo)
+    bars = StreamDataManager(stream, "bars", connector, Foo)
+
+    foos.upsert(Foo(id="key1", name="baz"))
+    foos.save()
+    bars.upsert(Foo(id="key2", name="bar"))
+    bars.save()
+
+    assert StreamDataManager(stream, "foos", connector, Foo).list() == [
+        Foo(id="key1", name="baz"),
+    ]
+
+
+def test_database_iter_filters_models(data_manager):
+    data_manager.bulk_upsert([
+        Foo(id="key1", name="baz"),
+        Foo(id="key2", name="bar"),
+        Foo(id="key3", name="baz"),
+    ])
+
+    found = sorted(data_manager.iter(name="baz"), key=lambda model: model.id)
+
+    assert found == [Foo(id="key1", name="baz"), Foo(id="key3", name="baz")]
+    assert len(data_manager.find_all()) == 3
+
+
+def test_database_iter_refuses_unknown_fields(data_manager):
+    with pytest.raises(ValueError):
+        data_manager.find_all(**{"name = name OR 1": 1})
+
+
+def test_database_prefetch_joins_related_models(data_manager, bars_manager):
+    data_manager.bulk_upsert([
+        Foo(id="key1", name="baz"),
+        Foo(id="key2", name="baz"),
+        Foo(id="key3", name="bar"),
+    ])
+    bars_manager.bulk_upsert([
+        Bar(id="bar1", foo_id="key1", name="a"),
+        Bar(id="bar2", foo_id="key3", name="b"),
+        Bar(id="bar3", foo_id="key1", name="c"),
+    ])
+
+    found = data_manager.prefetch(bars_manager, "foo_id", name="baz")
+
+    assert sorted(found, key=lambda pair: pair[0].id) == [
+        (
+            Foo(id="key1", name="baz"),
+            [
+                Bar(id="bar1", foo_id="key1", name="a"),
+                Bar(id="bar3", foo_id="key1", name="c"),
+            ],
+        ),
+        (Foo(id="key2", name="baz"), []),
+    ]
+
+
+def test_database_prefetch_refuses_unknown_fields(data_manager, bars_manager):
+    with pytest.raises(ValueError):
+        data_manager.prefetch(bars_manager, "foo_id", nope=1)
+    with pytest.raises(ValueError):
+        data_manager.prefetch(bars_manager, "1 OR 1")
+
+
+def test_sqlite_prefetch_runs_a_single_query(tmpdir):
+    with SqliteConnector(tmpdir / "db", TEST_SQL) as connector:
+        foos = SqliteDataManager("test", connector, Foo)
+        bars = SqliteDataManager("bars", connector, Bar)
+        foos.bulk_upsert(Foo(id=f"key{i}", name="baz") for i in range(10))
+        bars.bulk_upsert(
+            Bar(id=f"bar{i}", foo_id=f"key{i % 10}", name="a")
+            for i in range(30)
+        )
+
+        statements = []
+        connector._conn.set_trace_callback(statements.append)
+        found = foos.prefetch(bars, "foo_id", name="baz")
+
+    assert len(found) == 10
+    assert all(len(related) == 3 for _, related in found)
+    assert len(statements) == 1
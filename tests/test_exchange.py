@@ -0,0 +1,47 @@
+import io
+
+import pytest
+from qbackup.exchange import dump, guess_format, load
+
+
+RECORDS = [
+    ("periods", {"name": "daily", "schedule": None}),
+    ("groups", {"name": "work", "period": "daily"}),
+    ("groups", {"name": "media", "period": "daily"}),
+]
+
+
+@pytest.mark.parametrize("format", ["jsonl", "yaml"])
+def test_dump_and_load_roundtrip(format):
+    fp = io.StringIO()
+    assert dump(iter(RECORDS), fp, format) == 3
+
+    fp.seek(0)
+    assert list(load(fp, format)) == RECORDS
+
+
+def test_jsonl_is_one_record_per_line():
+    fp = io.StringIO()
+    dump(RECORDS, fp, "jsonl")
+
+    assert len(fp.getvalue().splitlines()) == 3
+
+
+def test_load_reports_invalid_jsonl_line():
+    fp = io.StringIO('{"model": "periods", "data": {}}\nnot json\n')
+
+    with pytest.raises(ValueError, match="line 2"):
+        list(load(fp, "jsonl"))
+
+
+@pytest.mark.parametrize(
+    "path,expected",
+    [
+        ("config.yaml", "yaml"),
+        ("config.yml", "yaml"),
+        ("config.jsonl", "jsonl"),
+        ("-", "jsonl"),
+    ],
+)
+def test_guess_format(path, expected):
+    assert guess_format(path) == expected
@@ -0,0 +1,102 @@
+import tarfile
+import pytest
+from qbackup import cli, pipeline
+from qbackup.pipeline import Pipeline
+from tests.fakequbes import FakeQubes
+
+MiB = 1024 * 1024
+
+
+@pytest.fixture
+def fake_qubes(tmp_path, monkeypatch):
+    qubes = FakeQubes(tmp_path / "qubes")
+    for name, value in qubes.install().items():
+        monkeypatch.setenv(name, value)
+
+    dom0 = tmp_path / "dom0"
+    dom0.mkdir()
+    monkeypatch.setenv("HOME", str(dom0))
+    monkeypatch.setattr(pipeline, "SYS_BLOCK", qubes.root / "sys" / "block")
+    return qubes
+
+
+def members(path):
+    with tarfile.open(path) as archive:
+        return archive.getnames()
+
+
+def test_pipeline_stores_backup_on_server(fake_qubes, tmp_path):
+    fake_qubes.add_qube("work", 20 * MiB)
+    fake_qubes.add_qube("backups", ssh_conn="server")
+    passphrase = tmp_path / "passphrase"
+    passphrase.write_text("abc\n")
+
+    backup = Pipeline(
+        "backups",
+        str(passphrase),
+        ["work"],
+        compression="none",
+        timeout=10,
+    )
+    backup.run()
+
+    stored, = fake_qubes.server("server").glob("*.backup")
+    assert members(stored) == [
+        "backup-header",
+        "qubes.xml.000",
+        "vm0/private.img.000",
+        "vm0/private.img.001",
+    ]
+    assert backup.metrics.spans[-1].bytes == stored.stat().st_size
+
+    state = fake_qubes.load()
+    assert state["loops"] == {}
+    assert state["attached"] == {}
+    assert not state["qubes"]["backups"]["running"]
+
+
+def test_run_sends_group_backup(fake_qubes, tmp_path):
+    fake_qubes.add_qube("mail", 2 * MiB)
+    fake_qubes.add_qube("notes", 1 * MiB)
+    fake_qubes.add_qube("home-backups", ssh_conn="server")
+    config = tmp_path / "config"
+
+    for argv in (
+        ["period", "add", "daily"],
+        ["group", "add", "work", "daily", "--compression", "gzip"],
+        ["qube", "add", "work", "mail", "notes"],
+        ["run", "daily"],
+    ):
+        cli.main(["-c", str(config), *argv])
+
+    stored, = fake_qubes.server("server").glob("work-*.backup")
+    assert members(stored) == [
+        "backup-header",
+        "qubes.xml.000",
+        "vm0/private.img.000",
+        "vm1/private.img.000",
+    ]
+    # half of the synthetic data is zeros
+    assert stored.stat().st_size < 2 * MiB
+
+
+def test_backup_qubes_fans_out_to_every_server(fake_qubes, tmp_path):
+    fake_qubes.add_qube("mail", 2 * MiB)
+    fake_qubes.add_qube("home-backups", ssh_conn="server1 server2")
+    manager = cli.QbackupCLIManager(None)
+    manager.args = None
+
+    run = manager.backup_qubes("work", ["mail"], "none", 2 * MiB)
+
+    stored = [
+        next(fake_qubes.server(host).glob("work-*.backup"))
+        for host in ("server1", "server2")
+    ]
+    assert stored[0].read_bytes() == stored[1].read_bytes()
+    assert members(stored[0]) == [
+        "backup-header",
+        "qubes.xml.000",
+        "vm0/private.img.000",
+    ]
+    assert run.name == "work"
+    assert run.output_bytes == stored[0].stat().st_size
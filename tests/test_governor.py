@@ -0,0 +1,72 @@
+import pytest
+
+from qbackup import governor
+from qbackup.governor import Governor, Priority, ionice_args
+
+
+def test_priority_wraps_command(monkeypatch):
+    monkeypatch.setattr(governor, "scopes_available", lambda: True)
+    priority = Priority(nice=10, ionice="best-effort:7", cpu_weight=20)
+
+    assert priority.command(["qvm-backup", "--yes"]) == [
+        "systemd-run", "--user", "--scope", "--quiet",
+        "-p", "CPUWeight=20", "--",
+        "ionice", "-c", "2", "-n", "7",
+        "nice", "-n", "10",
+        "qvm-backup", "--yes",
+    ]
+
+
+def test_priority_ignores_weights_without_systemd(monkeypatch):
+    monkeypatch.setattr(governor, "scopes_available", lambda: False)
+    priority = Priority(nice=5, io_weight=10)
+
+    assert priority.command(["qvm-backup"]) == [
+        "nice", "-n", "5", "qvm-backup",
+    ]
+
+
+def test_default_priority_leaves_command_alone():
+    assert Priority().command(["qvm-backup"]) == ["qvm-backup"]
+
+
+@pytest.mark.parametrize("value", ["fast", "idle:high", "best-effort:8"])
+def test_ionice_args_rejects_invalid_values(value):
+    with pytest.raises(ValueError):
+        ionice_args(value)
+
+
+def test_governor_is_busy_above_max_load(monkeypatch):
+    monkeypatch.setattr("os.getloadavg", lambda: (3.0, 1.0, 1.0))
+    monkeypatch.setattr("os.cpu_count", lambda: 4)
+
+    assert Governor(max_load=0.5).busy()
+    assert not Governor(max_load=1).busy()
+
+
+def test_governor_is_busy_while_the_user_is_active(monkeypatch):
+    monkeypatch.setattr(governor, "user_idle_seconds", lambda: 5.0)
+    assert Governor(idle_seconds=60).busy()
+
+    # no idle signal, e.g. without xprintidle
+    monkeypatch.setattr(governor, "user_idle_seconds", lambda: None)
+    assert not Governor(idle_seconds=60).busy()
+
+
+def test_governor_throttles_while_busy(monkeypatch, tmp_path):
+    monkeypatch.setattr(Governor, "busy", lambda self: True)
+    output = tmp_path / "output"
+
+    throttled = Governor(idle_seconds=60, duty=0.5, interval=0.1).run(
+        ["sh", "-c", f"sleep 0.2; cat > {output}"],
+        input=b"abc\n",
+    )
+
+    assert output.read_bytes() == b"abc\n"
+    assert throttled >= 0.1
+
+
+def test_governor_does_not_throttle_when_idle(monkeypatch):
+    monkeypatch.setattr(Governor, "busy", lambda self: False)
+
+    assert Governor(idle_seconds=60, interval=0.1).run(["true"]) == 0
@@ -0,0 +1,61 @@
+import pytest
+
+from qbackup import inventory
+from qbackup.api import ModelNotFound
+from qbackup.inventory import Inventory
+
+
+@pytest.fixture
+def listings(monkeypatch):
+    """`qvm-ls` results, one per call"""
+    results = []
+    calls = []
+
+    def qube_sizes():
+        calls.append(None)
+        return dict(results[min(len(calls), len(results)) - 1])
+
+    monkeypatch.setattr(inventory, "qube_sizes", qube_sizes)
+    return results, calls
+
+
+def test_sizes_are_cached_across_commands(listings, tmp_path):
+    results, calls = listings
+    results.append({"work": 100})
+    cache = tmp_path / inventory.CACHE_NAME
+
+    assert Inventory(cache).sizes() == {"work": 100}
+    assert Inventory(cache).sizes() == {"work": 100}
+    assert len(calls) == 1
+
+
+def test_stale_cache_is_listed_again(listings, tmp_path, monkeypatch):
+    results, calls = listings
+    results.extend([{"work": 100}, {"work": 200}])
+    cache = tmp_path / inventory.CACHE_NAME
+    Inventory(cache).sizes()
+
+    now = inventory.time.time()
+    monkeypatch.setattr("time.time", lambda: now + inventory.DEFAULT_TTL + 1)
+
+    assert Inventory(cache).sizes() == {"work": 200}
+    assert len(calls) == 2
+
+
+def test_new_qubes_are_found_past_the_cache(listings, tmp_path):
+    results, calls = listings
+    results.extend([{"work": 100}, {"work": 100, "vault": 10}])
+    cache = tmp_path / inventory.CACHE_NAME
+    Inventory(cache).sizes()
+
+    assert Inventory(cache).unknown(["vault", "work"]) == []
+    assert len(calls) == 2
+
+
+def test_validate_reports_every_unknown_qube(listings):
+    results, calls = listings
+    results.append({"work": 100})
+
+    with pytest.raises(ModelNotFound, match="Unknown qubes: wrok, vualt"):
+        Inventory().validate(["wrok", "work", "vualt", "wrok"])
+    assert len(calls) == 1
@@ -0,0 +1,82 @@
+import json
+
+from qbackup.metrics import Recorder, format_labels
+
+
+def test_spans_nest_within_a_thread():
+    recorder = Recorder()
+
+    with recorder.span("run", period="daily"):
+        with recorder.span("group", group="work") as span:
+            span.bytes = 1024
+
+    run, group = recorder.spans
+    assert run.parent is None
+    assert group.parent == 0
+    assert group.labels == {"group": "work"}
+    assert group.bytes == 1024
+    assert run.seconds >= group.seconds >= 0
+
+
+def test_span_is_recorded_when_the_block_fails():
+    recorder = Recorder()
+
+    try:
+        with recorder.span("qvm-backup"):
+            raise OSError("boom")
+    except OSError:
+        pass
+
+    assert [span.name for span in recorder.spans] == ["qvm-backup"]
+    assert recorder.spans[0].seconds >= 0
+
+
+def test_textfile_keeps_the_last_span_of_each_stage():
+    recorder = Recorder()
+    for size in (1, 2):
+        with recorder.span("group", group="work") as span:
+            span.bytes = size
+    with recorder.span("inventory"):
+        pass
+
+    text = recorder.textfile()
+
+    assert '# TYPE qbackup_stage_duration_seconds gauge' in text
+    assert 'qbackup_stage_bytes{stage="group",group="work"} 2\n' in text
+    assert 'qbackup_stage_bytes{stage="inventory"' not in text
+    assert text.count('qbackup_stage_duration_seconds{') == 2
+    assert "qbackup_last_run_timestamp_seconds{} " in text
+
+
+def test_textfile_labels_every_series():
+    recorder = Recorder()
+    with recorder.span("inventory"):
+        pass
+
+    text = recorder.textfile(run="daily")
+
+    assert 'qbackup_stage_duration_seconds{run="daily",stage="inventory"}' in text
+    assert 'qbackup_last_run_timestamp_seconds{run="daily"} ' in text
+
+
+def test_format_labels_escapes_values():
+    assert format_labels({"group": 'a"b\\c'}) == 'group="a\\"b\\\\c"'
+
+
+def test_export_writes_textfile_and_trace(tmp_path):
+    recorder = Recorder()
+    with recorder.span("run", period="daily"):
+        with recorder.span("group", group="work"):
+            pass
+
+    recorder.export(tmp_path / "run.prom", tmp_path / "run.json")
+
+    assert 'stage="run"' in (tmp_path / "run.prom").read_text()
+    events = json.loads((tmp_path / "run.json").read_text())["traceEvents"]
+    assert [event["name"] for event in events] == ["run", "group"]
+    assert events[1]["ph"] == "X"
+    assert events[1]["args"]["parent"] == "run"
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "run.json",
+        "run.prom",
+    ]
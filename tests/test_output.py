@@ -0,0 +1,40 @@
+import io
+import json
+
+from qbackup.models import Group
+from qbackup.output import print_models
+
+
+GROUPS = [
+    Group(name="work", period="daily"),
+    Group(name="media", period="weekly", compression="pigz"),
+]
+
+
+def render(models, format):
+    fp = io.StringIO()
+    print_models(iter(models), format, fp)
+    return fp.getvalue()
+
+
+def test_print_models_json():
+    assert json.loads(render(GROUPS, "json"))[1]["compression"] == "pigz"
+    assert json.loads(render([], "json")) == []
+
+
+def test_print_models_jsonl():
+    lines = render(GROUPS, "jsonl").splitlines()
+    assert [json.loads(line)["name"] for line in lines] == ["work", "media"]
+
+
+def test_print_models_tsv():
+    assert render(GROUPS, "tsv").splitlines() == [
+        "name\tperiod\tcompression\tsplittable",
+        "work\tdaily\t\tFalse",
+        "media\tweekly\tpigz\tFalse",
+    ]
+
+
+def test_print_models_tsv_escapes_separators():
+    group = Group(name="a\tb", period="c\nd")
+    assert render([group], "tsv").splitlines()[1] == "a\\tb\tc\\nd\t\tFalse"
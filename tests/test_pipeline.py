@@ -0,0 +1,52 @@
+import pytest
+from qbackup import pipeline
+from qbackup.pipeline import StageTimeout, block_users, wait_for
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr("time.monotonic", lambda: now[0])
+    monkeypatch.setattr("time.sleep", sleep)
+    return sleeps
+
+
+def test_wait_for_backs_off_until_ready(clock):
+    answers = iter([False, False, False, True])
+
+    waited = wait_for(lambda: next(answers), "thing", timeout=10)
+
+    assert clock == [0.1, 0.2, 0.4]
+    assert waited == pytest.approx(0.7)
+
+
+def test_wait_for_ready_does_not_sleep(clock):
+    assert wait_for(lambda: True, "thing") == 0
+    assert clock == []
+
+
+def test_wait_for_times_out(clock):
+    with pytest.raises(StageTimeout):
+        wait_for(lambda: False, "thing", timeout=3)
+
+    assert sum(clock) == pytest.approx(3)
+    assert max(clock) <= pipeline.POLL_MAXIMUM
+
+
+def test_block_users():
+    listing = (
+        "BACKEND:DEVID  DESCRIPTION  USED BY\n"
+        "dom0:loop0     /home/user/tmp/file.backup  backups "
+        "(frontend-dev=xvdi, read-only=False)\n"
+        "dom0:loop1     /home/user/other\n"
+    )
+
+    assert "backups" in block_users(listing, "dom0:loop0")
+    assert "backups" not in block_users(listing, "dom0:loop1")
+    assert block_users(listing, "dom0:loop2") is None
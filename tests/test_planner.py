@@ -0,0 +1,131 @@
+import random
+
+import pytest
+from qbackup.models import Run
+from qbackup.planner import (
+    DEFAULT_THROUGHPUT,
+    Job,
+    Unit,
+    estimate,
+    group_runs,
+    pack,
+    plan_units,
+)
+
+
+def makespan(plan):
+    return max(job.size for job in plan)
+
+
+def lower_bound(units, jobs):
+    sizes = [unit.size for unit in units]
+    return max(max(sizes), sum(sizes) / jobs)
+
+
+def test_plan_units_keeps_groups_together_unless_splittable():
+    members = {"work": ["a", "b"], "media": ["c", "d"], "empty": []}
+    sizes = {"a": 1, "b": 2, "c": 3, "d": 4}
+
+    units = plan_units(members, sizes, splittable={"media"})
+
+    assert units == [
+        Unit("work", ("a", "b"), 3),
+        Unit("media", ("c",), 3),
+        Unit("media", ("d",), 4),
+    ]
+
+
+def test_pack_puts_every_unit_in_exactly_one_job():
+    units = [Unit("g", (f"q{i}",), i) for i in range(20)]
+    plan = pack(units, 3)
+
+    packed = sorted(q for job in plan for q in job.qubes)
+    assert packed == sorted(f"q{i}" for i in range(20))
+
+
+def test_pack_isolates_a_huge_qube():
+    units = [Unit("big", ("big",), 400)] + [
+        Unit("small", (f"q{i}",), 10) for i in range(10)
+    ]
+    plan = pack(units, 2)
+
+    assert [job.qubes for job in plan][0] == ["big"]
+    assert makespan(plan) == 400
+
+
+def test_pack_never_creates_empty_jobs():
+    plan = pack([Unit("g", ("a",), 1), Unit("g", ("b",), 1)], 5)
+    assert len(plan) == 2
+
+
+def test_pack_refuses_invalid_number_of_jobs():
+    with pytest.raises(ValueError):
+        pack([], 0)
+
+
+@pytest.mark.parametrize(
+    "distribution",
+    [
+        lambda rng: rng.randint(1, 100),
+        lambda rng: int(rng.paretovariate(1.2) * 10),
+        lambda rng: rng.choice([1, 1, 1, 500]),
+    ],
+)
+@pytest.mark.parametrize("jobs", [2, 3, 8])
+def test_pack_balances_jobs_within_lpt_bound(distribution, jobs):
+    rng = random.Random(42)
+    units = [
+        Unit("g", (f"q{i}",), distribution(rng))
+        for i in range(100)
+    ]
+
+    plan = pack(units, jobs)
+
+    assert makespan(plan) <= 4 / 3 * lower_bound(units, jobs) + 1
+
+
+def test_job_main_group_holds_most_data():
+    plan = pack([Unit("a", ("x",), 1), Unit("b", ("y",), 5)], 1)
+    assert plan[0].main_group == "b"
+
+
+def test_estimate_without_history_uses_defaults():
+    result = estimate(DEFAULT_THROUGHPUT * 10, [], "none")
+    assert result.seconds == 10
+    assert result.output_bytes == result.input_bytes
+
+
+def test_estimate_learns_from_history():
+    runs = [
+        Run(name="work", seconds=10, input_bytes=1000, output_bytes=250),
+        Run(name="work", seconds=30, input_bytes=3000, output_bytes=750),
+        Run(name="work", seconds=None, input_bytes=None),
+    ]
+    result = estimate(2000, runs)
+    assert result.seconds == 20
+    assert result.output_bytes == 500
+
+
+def test_estimate_keeps_throttled_time():
+    runs = [Run(name="work", seconds=30, input_bytes=1000,
+                throttled_seconds=20)]
+    assert estimate(2000, runs).seconds == pytest.approx(60)
+
+
+def test_group_runs_share_the_job_run_by_size():
+    job = Job([
+        Unit("work", ("mail",), 300),
+        Unit("home", ("media",), 100),
+        Unit("work", ("notes",), 100),
+    ])
+    run = Run(name="daily-job0", started="now", seconds=10,
+              input_bytes=500, output_bytes=250, throttled_seconds=5)
+
+    assert [
+        (run.name, run.seconds, run.input_bytes, run.output_bytes,
+         run.throttled_seconds)
+        for run in group_runs(run, job)
+    ] == [
+        ("work", 8, 400, 200, 4),
+        ("home", 2, 100, 50, 1),
+    ]
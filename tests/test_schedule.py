@@ -0,0 +1,39 @@
+from datetime import datetime
+
+import pytest
+from qbackup.schedule import CronSchedule
+
+
+@pytest.mark.parametrize(
+    "expression, now, expected",
+    [
+        ("0 2 * * *", datetime(2021, 11, 11, 1, 30), datetime(2021, 11, 11, 2, 0)),
+        ("0 2 * * *", datetime(2021, 11, 11, 2, 0), datetime(2021, 11, 12, 2, 0)),
+        ("*/15 * * * *", datetime(2021, 11, 11, 2, 1, 30), datetime(2021, 11, 11, 2, 15)),
+        ("30 3 1 * *", datetime(2021, 12, 5), datetime(2022, 1, 1, 3, 30)),
+        # 2021-11-11 is a thursday
+        ("0 0 * * 0", datetime(2021, 11, 11), datetime(2021, 11, 14)),
+        ("0 0 * * 7", datetime(2021, 11, 11), datetime(2021, 11, 14)),
+        ("0 0 * * 1-5", datetime(2021, 11, 12, 12), datetime(2021, 11, 15)),
+        # either day field matches when both are restricted
+        ("0 0 13 * 0", datetime(2021, 11, 11), datetime(2021, 11, 13)),
+        ("@weekly", datetime(2021, 11, 11), datetime(2021, 11, 14)),
+        ("0 0 29 2 *", datetime(2021, 3, 1), datetime(2024, 2, 29)),
+    ],
+)
+def test_cron_schedule_next_run(expression, now, expected):
+    assert CronSchedule(expression).next_after(now) == expected
+
+
+@pytest.mark.parametrize(
+    "expression",
+    ["* * * *", "60 * * * *", "* 5-1 * * *", "@sometimes"],
+)
+def test_cron_schedule_refuses_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_cron_schedule_refuses_schedule_which_never_runs():
+    with pytest.raises(ValueError):
+        CronSchedule("0 0 30 2 *").next_after(datetime(2021, 1, 1))
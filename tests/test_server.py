@@ -0,0 +1,66 @@
+import json
+import os
+from pathlib import Path
+import socket
+
+import pytest
+from qbackup.server import SOCKET_NAME, handle, request, send, socket_path
+
+
+@pytest.mark.parametrize(
+    "argv,expected",
+    [
+        (["qube", "list"], "~/.config/qbackup"),
+        (["-c", "/etc/qbackup", "qube", "list"], "/etc/qbackup"),
+        (["--config=/etc/qbackup", "period", "list"], "/etc/qbackup"),
+    ],
+)
+def test_socket_path_follows_config_option(argv, expected):
+    assert socket_path(argv) == Path(expected).expanduser() / SOCKET_NAME
+
+
+def run_handle(execute, argv, cwd=None):
+    client, server_end = socket.socketpair()
+    with client, server_end:
+        with client.makefile("rw") as fp:
+            send(fp, {"argv": argv, "cwd": cwd or os.getcwd()})
+
+        with server_end.makefile("rw") as fp:
+            handle(server_end, fp, execute)
+        server_end.shutdown(socket.SHUT_WR)
+
+        with client.makefile("r") as fp:
+            return [json.loads(line) for line in fp]
+
+
+def test_handle_forwards_output_and_status():
+    def execute(argv):
+        print("listing", *argv)
+        return 3
+
+    messages = run_handle(execute, ["qube", "list"])
+
+    output = "".join(message.get("stdout", "") for message in messages)
+    assert output == "listing qube list\n"
+    assert messages[-1] == {"status": 3}
+
+
+def test_handle_asks_for_fallback():
+    assert run_handle(lambda argv: None, ["run", "daily"]) == [
+        {"fallback": True},
+    ]
+
+
+def test_handle_refuses_a_missing_working_directory(tmp_path):
+    workdir = os.getcwd()
+
+    messages = run_handle(lambda argv: 0, ["qube", "list"],
+                          str(tmp_path / "deleted"))
+
+    assert "Cannot run in" in messages[0]["stderr"]
+    assert messages[-1] == {"status": 1}
+    assert os.getcwd() == workdir
+
+
+def test_request_without_server_falls_back(tmp_path):
+    assert request(tmp_path / SOCKET_NAME, ["qube", "list"]) is None
@@ -0,0 +1,417 @@
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+import sqlite3
+import struct
+import subprocess
+import sys
+import tarfile
+import time
+
+import pytest
+
+SHELL = Path(__file__).parent.parent / "src" / "qbackup-shell"
+MiB = 1024 * 1024
+
+
+@pytest.fixture
+def server(tmp_path):
+    """Home and state directory of the backup user"""
+    home = tmp_path / "home"
+    state = tmp_path / "state"
+    home.mkdir()
+    state.mkdir()
+    return home, state
+
+
+def environment(server, ssh=True):
+    home, state = server
+    env = {
+        **os.environ,
+        "HOME": str(home),
+        "QBKP_STATE_DIR": str(state),
+        "QBKP_POOLS": str(state / "pools"),
+    }
+    if ssh:
+        env["SSH_CONNECTION"] = "127.0.0.1 0 127.0.0.1 22"
+    else:
+        env.pop("SSH_CONNECTION", None)
+    return env
+
+
+def shell(server, command, data=b"", ssh=True):
+    return subprocess.run(
+        [sys.executable, str(SHELL), "-c", command],
+        input=data,
+        capture_output=True,
+        env=environment(server, ssh),
+    )
+
+
+def test_upload_is_cataloged_out_of_the_home(server):
+    home, state = server
+
+    result = shell(server, "--size 3 work-2026-01-01T10-00.backup", b"abc")
+
+    assert result.returncode == 0, result.stderr
+    assert (home / "work-2026-01-01T10-00.backup").read_bytes() == b"abc"
+    with sqlite3.connect(state / "catalog.db") as catalog:
+        assert catalog.execute("SELECT path FROM backups").fetchall() == [
+            ("work-2026-01-01T10-00.backup",),
+        ]
+    assert sorted(path.name for path in home.iterdir()) == [
+        "work-2026-01-01T10-00.backup",
+        "work-2026-01-01T10-00.backup.manifest",
+    ]
+    # no pools to place the upload in
+    assert not (state / "placement.lock").exists()
+
+
+@pytest.mark.parametrize("name", [
+    "notes.txt",
+    ".qbackup-catalog.db",
+    ".ssh/keys.backup",
+    "work.backup.manifest",
+])
+def test_upload_refuses_reserved_names(server, name):
+    home, _ = server
+
+    result = shell(server, f"--size 3 {name}", b"abc")
+
+    assert result.returncode != 0
+    assert b"Not a backup name" in result.stderr
+    assert list(home.iterdir()) == []
+
+
+def test_prune_never_deletes_out_of_the_home(server, tmp_path):
+    home, state = server
+    victim = tmp_path / "victim-2026-01-01T10-00.backup"
+    victim.write_bytes(b"abc")
+    for day in ("02", "03"):
+        shell(server, f"--size 3 victim-2026-01-{day}T10-00.backup", b"abc")
+
+    with sqlite3.connect(state / "catalog.db") as catalog:
+        catalog.execute(
+            "INSERT INTO backups VALUES (?, 'victim-', ?, 3, NULL)",
+            [str(victim), "2026-01-01T10:00:00"],
+        )
+
+    shell(server, "--prune --keep-last 1 victim-", ssh=False)
+
+    assert victim.exists()
+    assert (home / "victim-2026-01-03T10-00.backup").exists()
+
+
+def test_resumed_range_keeps_its_start_time(server):
+    home, _ = server
+    name = "work-2026-01-01T10-00.backup"
+
+    first = shell(server, f"--range 0:6 --offset 0 --size 6 {name}", b"abc")
+    assert first.returncode != 0
+    time.sleep(1)
+    second = shell(server, f"--range 0:6 --offset 3 --size 6 {name}", b"def")
+
+    assert second.returncode == 0, second.stderr
+    assert (home / name).read_bytes() == b"abcdef"
+    manifest = json.loads((home / (name + ".manifest")).read_text())
+    assert manifest["seconds"] >= 1
+
+
+def test_concurrent_uploads_are_placed_in_different_pools(server):
+    _, state = server
+    pools = [state / "disk1", state / "disk2"]
+    (state / "pools").write_text("".join(f"{pool}\n" for pool in pools))
+    for pool in pools:
+        pool.mkdir()
+
+    first = subprocess.Popen(
+        [sys.executable, str(SHELL), "-c", "--size 3 a-2026-01-01T10-00.backup"],
+        stdin=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=environment(server),
+    )
+    try:
+        # the first upload is placed, and still running
+        deadline = time.monotonic() + 10
+        while not any(pool.glob(".qbackup-writers/*") for pool in pools):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+        second = shell(server, "--size 3 b-2026-01-01T10-00.backup", b"abc")
+    finally:
+        _, error = first.communicate(b"abc")
+
+    assert first.returncode == 0, error
+    assert second.returncode == 0, second.stderr
+    placed = {
+        pool.name: sorted(path.name for path in pool.glob("*.backup"))
+        for pool in pools
+    }
+    assert sorted(placed.values()) == [
+        ["a-2026-01-01T10-00.backup"],
+        ["b-2026-01-01T10-00.backup"],
+    ]
+
+
+def test_interrupted_upload_is_resumed(server):
+    home, _ = server
+    name = "work-2026-01-01T10-00.backup"
+
+    first = shell(server, f"--size 6 {name}", b"abcd")
+    assert first.returncode != 0
+    assert not (home / name).exists()
+    status = shell(server, f"--status {name}")
+    assert status.stdout == b"4\n"
+
+    second = shell(server, f"--offset 4 --size 6 {name}", b"ef")
+
+    assert second.returncode == 0, second.stderr
+    assert (home / name).read_bytes() == b"abcdef"
+    assert sorted(path.name for path in home.iterdir()) == [
+        name,
+        name + ".manifest",
+    ]
+
+
+def test_resume_past_the_committed_offset_is_refused(server):
+    home, _ = server
+    name = "work-2026-01-01T10-00.backup"
+    shell(server, f"--size 6 {name}", b"abcd")
+
+    result = shell(server, f"--offset 5 --size 6 {name}", b"f")
+
+    assert result.returncode != 0
+    assert b"Unable to resume from 5" in result.stderr
+    assert (home / (name + ".part")).read_bytes() == b"abcd"
+
+
+# without a checksum the stream is spliced, otherwise read into a buffer
+@pytest.mark.parametrize("checksum", ["none", "blake2b"])
+def test_upload_of_several_buffers_is_stored_intact(server, checksum):
+    home, _ = server
+    name = "work-2026-01-01T10-00.backup"
+    data = os.urandom(9 * MiB + 123)
+
+    result = shell(
+        server,
+        f"--size {len(data)} --checksum {checksum} {name}",
+        data,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert (home / name).read_bytes() == data
+    assert f"received {len(data)} bytes".encode() in result.stderr
+    assert b"MB/s" in result.stderr
+
+
+def test_interrupted_upload_keeps_no_preallocated_space(server):
+    home, _ = server
+    name = "work-2026-01-01T10-00.backup"
+
+    shell(server, f"--size {10 * MiB} {name}", bytes(3 * MiB))
+
+    assert (home / (name + ".part")).stat().st_size == 3 * MiB
+    assert shell(server, f"--status {name}").stdout == f"{3 * MiB}\n".encode()
+
+
+@pytest.mark.parametrize("algorithm", ["blake2b", "sha256"])
+def test_upload_digest_is_printed_and_recorded(server, algorithm):
+    home, _ = server
+    name = "work-2026-01-01T10-00.backup"
+    data = os.urandom(MiB)
+    digest = hashlib.new(algorithm, data).hexdigest()
+
+    result = shell(server, f"--checksum {algorithm} {name}", data)
+
+    assert result.stdout == f"{algorithm} {digest}\n".encode()
+    manifest = json.loads((home / (name + ".manifest")).read_text())
+    assert manifest["size"] == len(data)
+    assert (manifest["algorithm"], manifest["digest"]) == (algorithm, digest)
+
+
+def test_resumed_upload_digest_covers_the_whole_backup(server):
+    name = "work-2026-01-01T10-00.backup"
+    shell(server, f"--size 6 {name}", b"abcd")
+
+    result = shell(server, f"--offset 4 --size 6 {name}", b"ef")
+
+    digest = hashlib.blake2b(b"abcdef").hexdigest()
+    assert result.stdout == f"blake2b {digest}\n".encode()
+
+
+def stored(server, *names):
+    for name in names:
+        shell(server, f"--size 3 {name}", b"abc")
+
+
+def backups(server):
+    home, _ = server
+    return sorted(path.name for path in home.glob("*.backup"))
+
+
+def test_prune_keeps_the_newest_backup_of_each_day(server):
+    home, _ = server
+    stored(
+        server,
+        "work-2026-01-01T10-00.backup",
+        "work-2026-01-02T08-00.backup",
+        "work-2026-01-02T20-00.backup",
+        "work-2026-01-03T10-00.backup",
+        "mail-2026-01-01T10-00.backup",
+    )
+
+    result = shell(server, "--prune --keep-daily 2", ssh=False)
+
+    assert result.returncode == 0, result.stderr
+    assert backups(server) == [
+        "mail-2026-01-01T10-00.backup",
+        "work-2026-01-02T20-00.backup",
+        "work-2026-01-03T10-00.backup",
+    ]
+    assert not (home / "work-2026-01-01T10-00.backup.manifest").exists()
+
+
+@pytest.mark.parametrize("max_size, kept", [
+    (6, ["work-2026-01-02T10-00.backup", "work-2026-01-03T10-00.backup"]),
+    # the newest backup is kept, whatever its size
+    (1, ["work-2026-01-03T10-00.backup"]),
+])
+def test_prune_keeps_backups_under_max_size(server, max_size, kept):
+    stored(
+        server,
+        "work-2026-01-01T10-00.backup",
+        "work-2026-01-02T10-00.backup",
+        "work-2026-01-03T10-00.backup",
+    )
+
+    shell(server, f"--prune --max-size {max_size} work-", ssh=False)
+
+    assert backups(server) == kept
+
+
+def test_prune_dry_run_deletes_nothing(server):
+    names = ["work-2026-01-01T10-00.backup", "work-2026-01-02T10-00.backup"]
+    stored(server, *names)
+
+    result = shell(server, "--prune --keep-last 1 --dry-run", ssh=False)
+
+    assert b"pruning work-2026-01-01T10-00.backup" in result.stderr
+    assert backups(server) == names
+
+
+def extent(position, data=b""):
+    """An extent of a sparse stream, empty at the end of the backup"""
+    return struct.pack(">QQ", position, len(data)) + data
+
+
+def test_interrupted_sparse_upload_is_resumed(server):
+    home, _ = server
+    name = "work-2026-01-01T10-00.backup"
+    data = b"abc" + bytes(47) + b"de" + bytes(48)
+
+    # the stream ends before its last, empty, extent
+    shell(server, f"--sparse --size 100 {name}", extent(0, b"abc"))
+    assert shell(server, f"--status {name}").stdout == b"3\n"
+    result = shell(
+        server,
+        f"--sparse --offset 3 --size 100 {name}",
+        extent(50, b"de") + extent(100),
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert (home / name).read_bytes() == data
+    digest = hashlib.blake2b(data).hexdigest()
+    assert result.stdout == f"blake2b {digest}\n".encode()
+
+
+@pytest.mark.parametrize("stream", [
+    extent(98, b"abc") + extent(100),
+    extent(50, b"de") + extent(10, b"abc") + extent(100),
+])
+def test_sparse_upload_refuses_extents_out_of_order(server, stream):
+    home, _ = server
+    name = "work-2026-01-01T10-00.backup"
+
+    result = shell(server, f"--sparse --size 100 {name}", stream)
+
+    assert result.returncode != 0
+    assert b"Invalid extent" in result.stderr
+    assert not (home / name).exists()
+
+
+def test_read_serves_ranges_of_stored_backups_only(server):
+    name = "work-2026-01-01T10-00.backup"
+    shell(server, f"--size 6 {name}", b"abcdef")
+    shell(server, "--size 6 mail-2026-01-01T10-00.backup", b"abc")
+
+    assert shell(server, f"--read --range 2:3 {name}").stdout == b"cde"
+    assert shell(server, f"--read {name}").stdout == b"abcdef"
+
+    beyond = shell(server, f"--read --range 4:3 {name}")
+    assert beyond.returncode != 0
+    assert b"out of 6 bytes" in beyond.stderr
+
+    partial = shell(server, "--read mail-2026-01-01T10-00.backup.part")
+    assert partial.returncode != 0
+    assert b"Not a stored backup" in partial.stderr
+
+
+def test_index_covers_members_received_before_a_resume(server):
+    home, _ = server
+    name = "work-2026-01-01T10-00.backup"
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode="w", format=tarfile.GNU_FORMAT) \
+            as archive:
+        for number in range(4):
+            info = tarfile.TarInfo(f"vm{number}/private.img.000")
+            info.size = 1000
+            archive.addfile(info, io.BytesIO(os.urandom(1000)))
+    data = stream.getvalue()
+
+    shell(server, f"--size {len(data)} {name}", data[:3000])
+    shell(server, f"--offset 3000 --size {len(data)} {name}", data[3000:])
+
+    index = json.loads((home / (name + ".index")).read_text())
+    assert [
+        (member["name"], member["offset"], member["size"])
+        for member in index["members"]
+    ] == [
+        (f"vm{number}/private.img.000", number * 1536, 1000)
+        for number in range(4)
+    ]
+
+
+def test_ranges_arriving_out_of_order_are_committed_once(server):
+    home, _ = server
+    name = "work-2026-01-01T10-00.backup"
+
+    last = shell(server, f"--range 3:3 --offset 3 --size 6 {name}", b"def")
+    assert last.returncode == 0, last.stderr
+    assert not (home / name).exists()
+    first = shell(server, f"--range 0:3 --size 6 {name}", b"abc")
+
+    assert first.returncode == 0, first.stderr
+    assert b"committed" in first.stderr
+    assert (home / name).read_bytes() == b"abcdef"
+    assert sorted(path.name for path in home.iterdir()) == [
+        name,
+        name + ".manifest",
+    ]
+    manifest = json.loads((home / (name + ".manifest")).read_text())
+    assert [state["digest"] for state in manifest["ranges"]] == [
+        hashlib.blake2b(b"abc").hexdigest(),
+        hashlib.blake2b(b"def").hexdigest(),
+    ]
+
+
+def test_range_stream_may_not_go_past_its_end(server):
+    home, _ = server
+    name = "work-2026-01-01T10-00.backup"
+
+    result = shell(server, f"--range 0:3 --size 6 {name}", b"abcd")
+
+    assert result.returncode != 0
+    assert b"past its range end" in result.stderr
+    assert not (home / name).exists()